@@ -1,4 +1,5 @@
 from django.contrib import admin
+from .inbox import with_read_status
 from .models import ChatRoom, Message
 
 @admin.register(ChatRoom)
@@ -11,5 +12,12 @@ class ChatRoomAdmin(admin.ModelAdmin):
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
     list_display = ('sender', 'recipient', 'room', 'is_read', 'created_at')
-    list_filter = ('is_read', 'created_at')
+    list_filter = ('created_at',)
     search_fields = ('content', 'sender__username', 'recipient__username')
+
+    def get_queryset(self, request):
+        return with_read_status(super().get_queryset(request))
+
+    @admin.display(boolean=True)
+    def is_read(self, obj):
+        return obj.is_read
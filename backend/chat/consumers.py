@@ -1,7 +1,9 @@
 import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from .models import ChatRoom, Message
+from .models import ChatRoom
+from .inbox import mark_room_read
+from .writer import message_writer
 from django.contrib.auth import get_user_model
 from datetime import datetime
 
@@ -59,8 +61,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
         if message_type == 'message':
             message = data['message']
-            # Save message and get recipient
-            saved_message, recipient = await self.save_message(message)
+            saved_message = await self.save_message(message)
             
             # Send message to room group
             await self.channel_layer.group_send(
@@ -72,7 +73,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
                         'content': message,
                         'sender_id': self.user.id,
                         'sender_name': self.user.username,
-                        'recipient_id': recipient.id,
+                        'recipient_id': saved_message.recipient_id,
                         'timestamp': saved_message.created_at.isoformat(),
                         'is_read': False
                     }
@@ -88,12 +89,16 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 }
             )
         elif message_type == 'read':
-            await self.mark_messages_read()
+            # Read up to message_id, or everything when it's left out
+            last_read_message_id = await self.mark_messages_read(data.get('message_id'))
+            if last_read_message_id is None:
+                return
             await self.channel_layer.group_send(
                 self.room_group_name,
                 {
                     'type': 'messages_read',
-                    'user_id': self.user.id
+                    'user_id': self.user.id,
+                    'last_read_message_id': last_read_message_id
                 }
             )
 
@@ -120,34 +125,30 @@ class ChatConsumer(AsyncWebsocketConsumer):
     async def messages_read(self, event):
         await self.send(text_data=json.dumps({
             'type': 'read_receipt',
-            'user_id': event['user_id']
+            'user_id': event['user_id'],
+            'last_read_message_id': event['last_read_message_id']
         }))
 
     @database_sync_to_async
     def is_room_participant(self):
-        try:
-            room = ChatRoom.objects.get(id=self.room_id)
-            return room.participants.filter(id=self.user.id).exists()
-        except ChatRoom.DoesNotExist:
-            return False
-
-    @database_sync_to_async
-    def save_message(self, content):
-        room = ChatRoom.objects.get(id=self.room_id)
-        recipient = room.participants.exclude(id=self.user.id).first()
-        message = Message.objects.create(
-            room=room,
-            sender=self.user,
-            recipient=recipient,
-            content=content
+        # Membership is loaded once per connection; messages reuse it
+        participant_ids = list(
+            ChatRoom.participants.through.objects.filter(
+                chatroom_id=self.room_id
+            ).values_list('user_id', flat=True)
+        )
+        self.recipient_id = next(
+            (user_id for user_id in participant_ids if user_id != self.user.id), None
         )
-        room.save()  # Update the room's updated_at timestamp
-        return message, recipient
+        return self.user.id in participant_ids
+
+    async def save_message(self, content):
+        # Committed together with messages from other sockets in this process
+        return await message_writer.save(self.room_id, self.user.id, self.recipient_id, content)
 
     @database_sync_to_async
-    def mark_messages_read(self):
-        Message.objects.filter(
-            room_id=self.room_id,
-            recipient=self.user,
-            is_read=False
-        ).update(is_read=True) 
\ No newline at end of file
+    def mark_messages_read(self, message_id=None):
+        try:
+            return mark_room_read(self.room_id, self.user, message_id)
+        except (TypeError, ValueError):
+            return None 
\ No newline at end of file
@@ -0,0 +1,94 @@
+from collections import defaultdict
+from functools import reduce
+from operator import or_
+from django.db.models import (
+    BigIntegerField, Case, Count, Exists, F, OuterRef, Q, Subquery, Value, When
+)
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import ChatRoom, Message, ParticipantState
+
+
+def record_messages(messages):
+    """
+    Fold newly saved messages into the inbox state: each room's last
+    message and updated_at, and each recipient's unread counter.
+    Call inside the transaction that saved them.
+    """
+    if not messages:
+        return
+    latest = {}
+    unread = defaultdict(int)
+    for message in messages:
+        current = latest.get(message.room_id)
+        if current is None or (message.created_at, message.pk) > (current.created_at, current.pk):
+            latest[message.room_id] = message
+        unread[(message.room_id, message.recipient_id)] += 1
+
+    # last_message only moves forward: a batch committing after a later one
+    # mustn't put back an older message
+    ChatRoom.objects.filter(pk__in=list(latest)).update(
+        last_message=Case(
+            *[
+                When(
+                    Q(last_message__isnull=True) | Q(last_message__lt=message.pk),
+                    pk=room_id, then=Value(message.pk)
+                )
+                for room_id, message in latest.items()
+            ],
+            default=F('last_message'),
+            output_field=BigIntegerField(),
+        ),
+        updated_at=timezone.now(),
+    )
+
+    ParticipantState.objects.bulk_create(
+        [ParticipantState(room_id=room_id, user_id=user_id) for room_id, user_id in unread],
+        ignore_conflicts=True
+    )
+    # Recipients with the same number of new messages share one UPDATE
+    by_increment = defaultdict(list)
+    for key, count in unread.items():
+        by_increment[count].append(key)
+    for count, keys in by_increment.items():
+        condition = reduce(or_, [Q(room_id=room_id, user_id=user_id) for room_id, user_id in keys])
+        ParticipantState.objects.filter(condition).update(
+            unread_count=F('unread_count') + count, updated_at=timezone.now()
+        )
+
+
+def mark_room_read(room_id, user, message_id=None):
+    """
+    Move the user's read watermark up to message_id, or the room's last
+    message, with a single-row write. The unread counter is recounted from
+    the watermark in the same statement. Returns the watermark, or None if
+    message_id isn't a message of the room.
+    """
+    if message_id is None:
+        watermark = ChatRoom.objects.filter(pk=room_id).values_list('last_message_id', flat=True).first()
+    else:
+        watermark = Message.objects.filter(room_id=room_id, pk=message_id).values_list('pk', flat=True).first()
+    if watermark is None:
+        return None
+
+    remaining = Message.objects.filter(
+        room_id=room_id, recipient=user, id__gt=watermark
+    ).order_by().values('room').annotate(count=Count('id')).values('count')
+    # The watermark only moves forward
+    ParticipantState.objects.filter(room_id=room_id, user=user).filter(
+        Q(last_read_message__isnull=True) | Q(last_read_message__lt=watermark)
+    ).update(
+        last_read_message=watermark,
+        unread_count=Coalesce(Subquery(remaining), 0),
+        updated_at=timezone.now(),
+    )
+    return watermark
+
+
+def with_read_status(messages):
+    """Annotate each message's `is_read` from its recipient's read watermark"""
+    return messages.annotate(is_read=Exists(ParticipantState.objects.filter(
+        room=OuterRef('room'),
+        user=OuterRef('recipient'),
+        last_read_message__gte=OuterRef('pk'),
+    )))
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:52
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_initial'),
+        ('products', '0013_hot_query_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatroom',
+            index=models.Index(fields=['-updated_at'], name='chat_rooms_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', '-created_at'], name='messages_room_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', 'recipient', 'is_read'], name='messages_room_unread_idx'),
+        ),
+    ]
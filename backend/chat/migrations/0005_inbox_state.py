@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:04
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def populate_inbox_state(apps, schema_editor):
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    Message = apps.get_model('chat', 'Message')
+    ParticipantState = apps.get_model('chat', 'ParticipantState')
+    for room in ChatRoom.objects.iterator():
+        room.last_message = Message.objects.filter(room=room).order_by('-created_at', '-id').first()
+        if room.last_message is not None:
+            ChatRoom.objects.filter(pk=room.pk).update(last_message=room.last_message)
+        unread = dict(
+            Message.objects.filter(room=room, is_read=False).order_by()
+            .values_list('recipient').annotate(count=Count('id'))
+        )
+        ParticipantState.objects.bulk_create([
+            ParticipantState(room=room, user_id=user_id, unread_count=unread.get(user_id, 0))
+            for user_id in room.participants.values_list('id', flat=True)
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_message_history_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.message'),
+        ),
+        migrations.CreateModel(
+            name='ParticipantState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unread_count', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='participant_states', to='chat.chatroom')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_states', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'chat_participant_states',
+                'unique_together': {('user', 'room')},
+            },
+        ),
+        migrations.RunPython(populate_inbox_state, migrations.RunPython.noop),
+    ]
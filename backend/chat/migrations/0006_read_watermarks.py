@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:07
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_read_watermarks(apps, schema_editor):
+    Message = apps.get_model('chat', 'Message')
+    ParticipantState = apps.get_model('chat', 'ParticipantState')
+    # The newest message each participant has read becomes their watermark
+    watermarks = (
+        Message.objects.filter(is_read=True).order_by()
+        .values_list('room', 'recipient').annotate(last_read=Max('id'))
+    )
+    for room_id, user_id, last_read in watermarks:
+        ParticipantState.objects.filter(room_id=room_id, user_id=user_id).update(
+            last_read_message_id=last_read
+        )
+    # Unread messages older than the watermark now count as read
+    remaining = Message.objects.filter(
+        room=OuterRef('room'), recipient=OuterRef('user'),
+        id__gt=Coalesce(OuterRef('last_read_message'), 0),
+    ).order_by().values('room').annotate(count=Count('id')).values('count')
+    ParticipantState.objects.update(unread_count=Coalesce(Subquery(remaining), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_inbox_state'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='participantstate',
+            name='last_read_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.message'),
+        ),
+        migrations.RunPython(populate_read_watermarks, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='message',
+            name='messages_room_unread_idx',
+        ),
+        migrations.RemoveField(
+            model_name='message',
+            name='is_read',
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', 'recipient', 'id'], name='messages_room_recipient_idx'),
+        ),
+    ]
@@ -5,21 +5,49 @@ from products.models import Product
 class ChatRoom(models.Model):
     participants = models.ManyToManyField(settings.AUTH_USER_MODEL, related_name='chat_rooms')
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='chat_rooms')
+    # Kept current by chat.inbox.record_messages so the inbox needs no message scan
+    last_message = models.ForeignKey(
+        'Message', on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'chat_rooms'
         ordering = ['-updated_at']
+        indexes = [
+            models.Index(fields=['-updated_at'], name='chat_rooms_updated_idx'),
+        ]
 
 class Message(models.Model):
     room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='messages')
     sender = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     recipient = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='received_messages')
     content = models.TextField()
-    is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         db_table = 'messages'
         ordering = ['-created_at']
+        indexes = [
+            # A room's history pages in either direction, and its latest message
+            models.Index(fields=['room', 'created_at', 'id'], name='messages_room_history_idx'),
+            # Unread counts: a recipient's messages past their read watermark
+            models.Index(fields=['room', 'recipient', 'id'], name='messages_room_recipient_idx'),
+        ]
+
+class ParticipantState(models.Model):
+    """A participant's denormalized view of a room, maintained as messages arrive and are read"""
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='participant_states')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='chat_states')
+    unread_count = models.IntegerField(default=0)
+    # Every message in the room up to this one has been read by the user
+    last_read_message = models.ForeignKey(
+        Message, on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'chat_participant_states'
+        # Also the index behind the inbox and ETag lookups by user
+        unique_together = ['user', 'room']
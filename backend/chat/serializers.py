@@ -1,20 +1,40 @@
 from rest_framework import serializers
-from .models import ChatRoom, Message
+from .models import ChatRoom, Message, ParticipantState
 from users.serializers import UserDetailSerializer
 from products.serializers import ProductSerializer
 
+# Export column -> queryset lookup for ?output=csv/ndjson chat exports;
+# is_read is annotated by chat.inbox.with_read_status
+MESSAGE_EXPORT_COLUMNS = {
+    'id': 'id',
+    'sender': 'sender__email',
+    'recipient': 'recipient__email',
+    'content': 'content',
+    'is_read': 'is_read',
+    'created_at': 'created_at',
+}
+
 class MessageSerializer(serializers.ModelSerializer):
     sender = UserDetailSerializer(read_only=True)
+    is_read = serializers.SerializerMethodField()
     is_own_message = serializers.SerializerMethodField()
     
     class Meta:
         model = Message
         fields = ['id', 'sender', 'content', 'is_read', 'created_at', 'is_own_message']
 
+    def get_is_read(self, obj):
+        # Annotated by chat.inbox.with_read_status
+        if hasattr(obj, 'is_read'):
+            return obj.is_read
+        return ParticipantState.objects.filter(
+            room_id=obj.room_id, user_id=obj.recipient_id, last_read_message__gte=obj.pk
+        ).exists()
+
     def get_is_own_message(self, obj):
         request = self.context.get('request')
         if request and hasattr(request, 'user'):
-            return obj.sender == request.user
+            return obj.sender_id == request.user.id
         return False
 
 class ChatRoomSerializer(serializers.ModelSerializer):
@@ -32,24 +52,31 @@ class ChatRoomSerializer(serializers.ModelSerializer):
         ]
 
     def get_last_message(self, obj):
-        message = obj.messages.first()
-        if message:
-            return MessageSerializer(message, context=self.context).data
+        # ChatViewSet loads it, and whether it was read, with the room
+        if obj.last_message_id:
+            if hasattr(obj, 'last_message_read'):
+                obj.last_message.is_read = obj.last_message_read
+            return MessageSerializer(obj.last_message, context=self.context).data
         return None
 
     def get_unread_count(self, obj):
         request = self.context.get('request')
+        if hasattr(obj, 'unread_total'):
+            return obj.unread_total
         if request and hasattr(request, 'user'):
-            return obj.messages.filter(
-                is_read=False,
-                recipient=request.user
-            ).count()
+            count = obj.participant_states.filter(
+                user=request.user
+            ).values_list('unread_count', flat=True).first()
+            return count or 0
         return 0
 
     def get_other_participant(self, obj):
         request = self.context.get('request')
         if request and hasattr(request, 'user'):
-            other_user = obj.participants.exclude(id=request.user.id).first()
+            other_user = next(
+                (user for user in obj.participants.all() if user.id != request.user.id),
+                None
+            )
             if other_user:
                 return UserDetailSerializer(other_user).data
         return None 
\ No newline at end of file
@@ -0,0 +1,10 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from .inbox import record_messages
+from .models import Message
+
+
+@receiver(post_save, sender=Message)
+def update_inbox(sender, instance, created=False, raw=False, **kwargs):
+    if created and not raw:
+        record_messages([instance])
@@ -1,3 +1,329 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+from unittest import mock, skipUnless
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import re_path
+from products.tests import ProductTestCase, QueryBudgetMixin, create_products
+from .consumers import ChatConsumer
+from .inbox import record_messages
+from .models import ChatRoom, Message
+from .writer import message_writer
 
-# Create your tests here.
+try:
+    # channels.testing needs daphne
+    from channels.testing import WebsocketCommunicator
+    import channels_redis
+    import fakeredis
+    from fakeredis.aioredis import FakeConnection
+except ImportError:
+    channels_redis = fakeredis = None
+
+
+class ChatTestCase(ProductTestCase):
+    def grow_rooms(self, count):
+        for product in create_products(self.seller, self.category, count - ChatRoom.objects.count()):
+            room = ChatRoom.objects.create(product=product)
+            room.participants.add(self.seller, self.buyer)
+            for sender, recipient in ((self.buyer, self.seller), (self.seller, self.buyer)):
+                Message.objects.create(
+                    room=room, sender=sender, recipient=recipient, content='Is this available?'
+                )
+
+
+class ChatQueryBudgetTests(QueryBudgetMixin, ChatTestCase):
+    def test_room_list(self):
+        self.authenticate(self.buyer)
+        # user, ETag aggregates (3), rooms with last messages and unread counts,
+        # participants, images
+        self.assertQueryBudget(7, '/api/chat/rooms/', self.grow_rooms)
+
+    def test_room_messages(self):
+        self.authenticate(self.buyer)
+        self.grow_rooms(1)
+        room = ChatRoom.objects.get()
+
+        def grow(count):
+            while room.messages.count() < count:
+                Message.objects.create(
+                    room=room, sender=self.seller, recipient=self.buyer, content='Yes'
+                )
+
+        # user, room, messages with senders, read watermarks
+        self.assertQueryBudget(4, f'/api/chat/rooms/{room.id}/messages/', grow)
+        # ... plus the ?after= anchor
+        first = room.messages.order_by('id').first()
+        self.assertQueryBudget(5, f'/api/chat/rooms/{room.id}/messages/', grow, {'after': first.id})
+
+    def test_message_export_streams_csv(self):
+        self.authenticate(self.buyer)
+        self.grow_rooms(1)
+        room = ChatRoom.objects.get()
+        response = self.client.get(f'/api/chat/rooms/{room.id}/messages/', {'output': 'csv'})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(
+            [(row['sender'], row['content']) for row in rows],
+            [('buyer@example.com', 'Is this available?'), ('seller@example.com', 'Is this available?')]
+        )
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Plans are captured with SQLite EXPLAIN QUERY PLAN')
+class ChatQueryPlanTests(QueryBudgetMixin, ChatTestCase):
+    def test_chat_queries_use_indexes(self):
+        self.authenticate(self.buyer)
+        self.grow_rooms(3)
+        room = ChatRoom.objects.first()
+        self.assertNoFullScans('/api/chat/rooms/')
+        self.assertNoFullScans(f'/api/chat/rooms/{room.id}/')
+        self.assertNoFullScans(f'/api/chat/rooms/{room.id}/messages/')
+        self.assertNoFullScans(f'/api/chat/rooms/{room.id}/messages/', {
+            'after': room.messages.order_by('id').first().id
+        })
+        self.assertNoFullScans(f'/api/chat/rooms/{room.id}/unread_count/')
+        # Renders ChatRoomSerializer without the list prefetches
+        self.assertNoFullScans('/api/chat/rooms/create/', {
+            'product_id': room.product_id, 'seller_id': self.seller.id
+        }, method='post')
+
+
+class ChatMessageHistoryTests(ChatTestCase):
+    def test_history_pages_newest_first_and_syncs_incrementally(self):
+        self.authenticate(self.buyer)
+        self.grow_rooms(2)
+        room = ChatRoom.objects.order_by('id').first()
+        for i in range(5):
+            Message.objects.create(room=room, sender=self.seller, recipient=self.buyer, content=f'#{i}')
+        url = f'/api/chat/rooms/{room.id}/messages/'
+
+        response = self.client.get(url, {'page_size': 4})
+        self.assertEqual([m['content'] for m in response.data['results']], ['#4', '#3', '#2', '#1'])
+        older = self.client.get(response.data['next'])
+        self.assertEqual([m['content'] for m in older.data['results']][0], '#0')
+        self.assertIsNone(older.data['next'])
+
+        # A reconnecting client asks for everything after the last message it has
+        last_seen = room.messages.get(content='#2')
+        Message.objects.create(room=room, sender=self.seller, recipient=self.buyer, content='#5')
+        response = self.client.get(url, {'after': last_seen.id})
+        self.assertEqual([m['content'] for m in response.data['results']], ['#3', '#4', '#5'])
+
+        other_room = Message.objects.exclude(room=room).first()
+        for after in ['nope', other_room.id]:
+            self.assertEqual(self.client.get(url, {'after': after}).status_code, 400)
+
+
+class ChatInboxTests(ChatTestCase):
+    def inbox(self):
+        response = self.client.get('/api/chat/rooms/')
+        return {
+            room['id']: (room['last_message']['content'], room['unread_count'])
+            for room in response.data
+        }
+
+    def test_inbox_state_follows_messages_and_reads(self):
+        self.authenticate(self.buyer)
+        self.grow_rooms(2)
+        first, second = ChatRoom.objects.order_by('id')
+        self.assertEqual(self.inbox(), {
+            first.id: ('Is this available?', 1), second.id: ('Is this available?', 1)
+        })
+
+        async_to_sync(message_writer.save)(first.id, self.seller.id, self.buyer.id, 'Yes')
+        async_to_sync(message_writer.save)(second.id, self.buyer.id, self.seller.id, 'Price?')
+        self.assertEqual(self.inbox(), {first.id: ('Yes', 2), second.id: ('Price?', 1)})
+
+        self.client.post(f'/api/chat/rooms/{first.id}/mark_read/')
+        self.assertEqual(self.inbox()[first.id], ('Yes', 0))
+        response = self.client.get(f'/api/chat/rooms/{second.id}/unread_count/')
+        self.assertEqual(response.data['unread_count'], 1)
+
+    def test_last_message_only_moves_forward(self):
+        self.authenticate(self.buyer)
+        self.grow_rooms(1)
+        room = ChatRoom.objects.get()
+        # Two batches whose transactions commit in the opposite order
+        older, newer = Message.objects.bulk_create([
+            Message(room=room, sender=self.seller, recipient=self.buyer, content=content)
+            for content in ('Older', 'Newer')
+        ])
+        record_messages([newer])
+        record_messages([older])
+        self.assertEqual(self.inbox(), {room.id: ('Newer', 3)})
+
+
+    def test_nested_product_and_participant_edits_move_the_etag(self):
+        self.authenticate(self.buyer)
+        self.grow_rooms(1)
+        room = ChatRoom.objects.get()
+
+        def edit_listing():
+            room.product.title = 'Phone, price dropped'
+            room.product.save()
+
+        def edit_seller():
+            self.seller.first_name = 'Asha'
+            self.seller.save()
+
+        for url in ['/api/chat/rooms/', f'/api/chat/rooms/{room.id}/']:
+            for edit in (edit_listing, edit_seller):
+                etag = self.client.get(url)['ETag']
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+                edit()
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class ChatReadWatermarkTests(ChatTestCase):
+    def test_reads_move_a_single_watermark(self):
+        self.authenticate(self.buyer)
+        self.grow_rooms(1)
+        room = ChatRoom.objects.get()
+        for i in range(4):
+            Message.objects.create(room=room, sender=self.seller, recipient=self.buyer, content=f'#{i}')
+        url = f'/api/chat/rooms/{room.id}/'
+        second = room.messages.get(content='#1')
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(f'{url}mark_read/', {'message_id': second.id})
+        self.assertEqual(response.data['last_read_message_id'], second.id)
+        updates = [query['sql'] for query in context.captured_queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('chat_participant_states', updates[0])
+        self.assertEqual(self.client.get(f'{url}unread_count/').data['unread_count'], 2)
+
+        response = self.client.get(f'{url}messages/')
+        self.assertEqual(
+            response.data['read_up_to'], {str(self.buyer.id): second.id, str(self.seller.id): None}
+        )
+        history = response.data['results']
+        received = {m['content']: m['is_read'] for m in history if m['sender']['id'] == self.seller.id}
+        self.assertEqual(received, {
+            '#3': False, '#2': False, '#1': True, '#0': True, 'Is this available?': True
+        })
+        # The seller hasn't read the buyer's message
+        self.assertEqual([m['is_read'] for m in history if m['sender']['id'] == self.buyer.id], [False])
+
+        # Watermarks never move backwards
+        first = room.messages.get(content='#0')
+        self.client.post(f'{url}mark_read/', {'message_id': first.id})
+        self.assertEqual(self.client.get(f'{url}unread_count/').data['unread_count'], 2)
+        self.client.post(f'{url}mark_read/')
+        self.assertEqual(self.client.get(f'{url}unread_count/').data['unread_count'], 0)
+        self.assertEqual(self.client.post(f'{url}mark_read/', {'message_id': 'nope'}).status_code, 400)
+
+
+class ChatMessageWriterTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.grow_rooms(2)
+
+    def save_all(self, *messages):
+        async def save():
+            return await asyncio.gather(
+                *[message_writer.save(*message) for message in messages], return_exceptions=True
+            )
+        return async_to_sync(save)()
+
+    def test_concurrent_messages_share_one_commit(self):
+        rooms = list(ChatRoom.objects.order_by('id'))
+        with CaptureQueriesContext(connection) as context:
+            saved = self.save_all(*[
+                (rooms[i % 2].id, self.buyer.id, self.seller.id, f'Offer {i}') for i in range(6)
+            ])
+        self.assertEqual([message.content for message in saved], [f'Offer {i}' for i in range(6)])
+        self.assertTrue(all(message.pk for message in saved))
+        statements = [' '.join(query['sql'].split()[:3]) for query in context.captured_queries]
+        self.assertEqual(statements.count('INSERT INTO "messages"'), 1)
+        self.assertEqual(statements.count('UPDATE "chat_rooms" SET'), 1)
+        self.assertEqual(Message.objects.filter(content__startswith='Offer').count(), 6)
+
+    def test_a_failed_message_does_not_fail_the_batch(self):
+        room = ChatRoom.objects.first()
+        good, bad = self.save_all(
+            (room.id, self.buyer.id, self.seller.id, 'Hello'),
+            (room.id, self.buyer.id, None, 'No recipient'),
+        )
+        self.assertEqual(good.content, 'Hello')
+        self.assertIsInstance(bad, Exception)
+        self.assertTrue(Message.objects.filter(content='Hello').exists())
+
+    def test_messages_queued_on_another_loop_are_still_written(self):
+        room = ChatRoom.objects.first()
+        first, second = asyncio.new_event_loop(), asyncio.new_event_loop()
+        self.addCleanup(second.close)
+        self.addCleanup(first.close)
+        with mock.patch('chat.writer.write_messages', side_effect=lambda messages: messages):
+            pending = first.create_task(message_writer.save(room.id, self.buyer.id, self.seller.id, 'Hi'))
+            # One pass of the first loop queues the message but doesn't start writing it
+            first.call_soon(first.stop)
+            first.run_forever()
+            saved = second.run_until_complete(
+                message_writer.save(room.id, self.seller.id, self.buyer.id, 'Hello')
+            )
+            self.assertEqual(saved.content, 'Hello')
+            saved = first.run_until_complete(asyncio.wait_for(pending, 1))
+            self.assertEqual(saved.content, 'Hi')
+        for loop in [first, second]:
+            for task in asyncio.all_tasks(loop):
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*asyncio.all_tasks(loop), return_exceptions=True))
+
+
+@skipUnless(channels_redis and fakeredis, 'Needs daphne, channels_redis and fakeredis')
+class ChatChannelLayerTests(ProductTestCase):
+    """Two ASGI workers with their own Redis channel layers, sharing one (fake) Redis"""
+
+    def setUp(self):
+        super().setUp()
+        product = create_products(self.seller, self.category, 1)[0]
+        self.room = ChatRoom.objects.create(product=product)
+        self.room.participants.add(self.seller, self.buyer)
+        server = fakeredis.FakeServer()
+        layer = {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [{'connection_class': FakeConnection, 'server': server}]},
+        }
+        settings = override_settings(CHANNEL_LAYERS={'worker_a': layer, 'worker_b': layer})
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def connect(self, worker, user):
+        consumer = type(f'ChatConsumer_{worker}', (ChatConsumer,), {'channel_layer_alias': worker})
+        application = URLRouter([re_path(r'ws/chat/(?P<room_id>\w+)/$', consumer.as_asgi())])
+        communicator = WebsocketCommunicator(application, f'/ws/chat/{self.room.id}/')
+        communicator.scope['user'] = user
+        return communicator
+
+    async def receive(self, communicator, event_type):
+        while True:
+            event = await communicator.receive_json_from(timeout=2)
+            if event['type'] == event_type:
+                return event
+
+    async def test_messages_reach_sockets_on_other_workers(self):
+        buyer = self.connect('worker_b', self.buyer)
+        seller = self.connect('worker_a', self.seller)
+        self.assertTrue((await buyer.connect())[0])
+        self.assertTrue((await seller.connect())[0])
+        # The seller's presence crosses from worker A to worker B too
+        status = await self.receive(buyer, 'status')
+        self.assertEqual(status['user_id'], self.buyer.id)
+        status = await self.receive(buyer, 'status')
+        self.assertEqual(status['user_id'], self.seller.id)
+
+        await seller.send_json_to({'type': 'message', 'message': 'Still available?'})
+        event = await self.receive(buyer, 'message')
+        self.assertEqual(event['message']['content'], 'Still available?')
+        self.assertEqual(event['message']['recipient_id'], self.buyer.id)
+
+        await buyer.send_json_to({'type': 'read'})
+        receipt = await self.receive(seller, 'read_receipt')
+        self.assertEqual(receipt['last_read_message_id'], event['message']['id'])
+
+        await seller.disconnect()
+        await buyer.disconnect()
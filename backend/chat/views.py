@@ -2,22 +2,85 @@ from django.shortcuts import render
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.exceptions import ValidationError
 from django.shortcuts import get_object_or_404
-from django.db.models import Q
+from django.db.models import Q, Count, Exists, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
 
 # We'll create these models and serializers later
-from .models import ChatRoom, Message
-from .serializers import ChatRoomSerializer, MessageSerializer
+from .models import ChatRoom, Message, ParticipantState
+from .inbox import mark_room_read, with_read_status
+from .serializers import ChatRoomSerializer, MessageSerializer, MESSAGE_EXPORT_COLUMNS
 from products.models import Product
+from localmart.conditional import ConditionalGetMixin
+from localmart.pagination import KeysetPagination
+from localmart.exports import get_export_format, stream_export
 
-class ChatViewSet(viewsets.ModelViewSet):
+class ChatViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = ChatRoomSerializer
     
     def get_queryset(self):
-        return ChatRoom.objects.filter(
-            participants=self.request.user
-        ).order_by('-updated_at')
+        user = self.request.user
+        queryset = ChatRoom.objects.filter(participants=user).order_by('-updated_at')
+        if self.action not in ['list', 'retrieve']:
+            return queryset
+
+        # Everything ChatRoomSerializer renders, in a fixed number of queries;
+        # the last message and unread count come from the denormalized inbox state
+        unread = ParticipantState.objects.filter(
+            room=OuterRef('pk'), user=user
+        ).values('unread_count')[:1]
+        last_message_read = ParticipantState.objects.filter(
+            room=OuterRef('pk'),
+            user=OuterRef('last_message__recipient'),
+            last_read_message__gte=OuterRef('last_message'),
+        )
+
+        return queryset.select_related(
+            'product__seller', 'product__category', 'last_message__sender'
+        ).prefetch_related(
+            'participants',
+            'product__images',
+        ).annotate(
+            unread_total=Coalesce(Subquery(unread), 0),
+            last_message_read=Exists(last_message_read),
+        )
+    
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, request, *args, **kwargs)
+
+    def get_validators(self, request, pk=None, **kwargs):
+        # New messages bump ChatRoom.updated_at; reads move a participant's
+        # state. Listing edits (images included) move the nested product's
+        # updated_at and profile edits the participants'
+        rooms = ChatRoom.objects.filter(participants=request.user)
+        if pk is not None:
+            try:
+                rooms = rooms.filter(pk=pk)
+            except ValueError:
+                return None
+        stats = rooms.aggregate(
+            count=Count('id', distinct=True),
+            last_updated=Max('updated_at'),
+            product_updated=Max('product__updated_at'),
+        )
+        # A separate join: reusing the filter's would only see request.user
+        participants = ChatRoom.participants.through.objects.filter(chatroom__in=rooms).aggregate(
+            last_updated=Max('user__updated_at')
+        )
+        reads = ParticipantState.objects.filter(room__in=rooms).aggregate(
+            unread=Sum('unread_count', filter=Q(user=request.user)), last_read=Max('updated_at')
+        )
+        params = sorted(request.query_params.lists())
+        return [
+            request.user.id, pk, stats['count'], stats['last_updated'],
+            stats['product_updated'], participants['last_updated'],
+            reads['unread'], reads['last_read'], params
+        ], None
     
     @action(detail=False, methods=['POST'])
     def create_or_get_room(self, request):
@@ -55,30 +118,65 @@ class ChatViewSet(viewsets.ModelViewSet):
     
     @action(detail=True, methods=['GET'])
     def messages(self, request, pk=None):
-        """Get messages for a chat room"""
+        """
+        Get messages for a chat room, newest first, a page at a time.
+        ?after=<message_id> instead returns what came after that message,
+        oldest first, for clients catching up after a reconnect.
+        `read_up_to` maps each participant to their read watermark, so
+        clients can refresh is_read on messages they already hold.
+        """
         chat_room = self.get_object()
-        messages = Message.objects.filter(room=chat_room)
-        serializer = MessageSerializer(messages, many=True)
-        return Response(serializer.data)
+        output = get_export_format(request)
+        if output:
+            messages = with_read_status(Message.objects.filter(room=chat_room)).order_by('created_at', 'id')
+            return stream_export(messages, MESSAGE_EXPORT_COLUMNS, output, f'chat-{chat_room.id}')
+
+        messages = with_read_status(Message.objects.filter(room=chat_room).select_related('sender'))
+        after = request.query_params.get('after')
+        if after is not None:
+            try:
+                anchor = messages.filter(pk=after).values('created_at', 'id').first()
+            except ValueError:
+                anchor = None
+            if anchor is None:
+                raise ValidationError({'after': 'Unknown message'})
+            messages = messages.filter(
+                Q(created_at__gt=anchor['created_at'])
+                | Q(created_at=anchor['created_at'], id__gt=anchor['id'])
+            ).order_by('created_at', 'id')
+        else:
+            messages = messages.order_by('-created_at', '-id')
+
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(messages, request, view=self)
+        serializer = MessageSerializer(page, many=True, context={'request': request})
+        response = paginator.get_paginated_response(serializer.data)
+        response.data['read_up_to'] = {
+            str(user_id): last_read
+            for user_id, last_read in ParticipantState.objects.filter(
+                room=chat_room
+            ).values_list('user_id', 'last_read_message_id')
+        }
+        return response
     
     @action(detail=True, methods=['POST'])
     def mark_read(self, request, pk=None):
-        """Mark all messages in the room as read"""
+        """Mark messages in the room as read, up to `message_id` or all of them"""
         chat_room = self.get_object()
-        Message.objects.filter(
-            room=chat_room,
-            recipient=request.user,
-            is_read=False
-        ).update(is_read=True)
-        return Response({'status': 'messages marked as read'})
+        message_id = request.data.get('message_id')
+        try:
+            watermark = mark_room_read(chat_room.id, request.user, message_id)
+        except (TypeError, ValueError):
+            watermark = None
+        if watermark is None and message_id is not None:
+            raise ValidationError({'message_id': 'Unknown message'})
+        return Response({'status': 'messages marked as read', 'last_read_message_id': watermark})
 
     @action(detail=True, methods=['GET'])
     def unread_count(self, request, pk=None):
         """Get number of unread messages in the room"""
         chat_room = self.get_object()
-        count = Message.objects.filter(
-            room=chat_room,
-            recipient=request.user,
-            is_read=False
-        ).count()
-        return Response({'unread_count': count})
+        count = ParticipantState.objects.filter(
+            room=chat_room, user=request.user
+        ).values_list('unread_count', flat=True).first()
+        return Response({'unread_count': count or 0})
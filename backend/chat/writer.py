@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import weakref
+from channels.db import database_sync_to_async
+from django.db import transaction
+from .inbox import record_messages
+from .models import Message
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_SIZE = 200
+# Longest a message waits for others to share its commit, in seconds
+MAX_BATCH_DELAY = 0.01
+# Senders wait for room in the queue beyond this many unsaved messages
+MAX_PENDING_MESSAGES = 1000
+
+
+def write_messages(messages):
+    """Insert a batch of messages and update their rooms' inbox state in one transaction"""
+    with transaction.atomic():
+        messages = Message.objects.bulk_create(messages)
+        # bulk_create skips the post_save receiver that does this for single messages
+        record_messages(messages)
+    return messages
+
+
+class MessageWriter:
+    """
+    Group-commits chat messages from every consumer in the process.
+
+    Messages are queued on the event loop and written by a single task in
+    batches of up to MAX_BATCH_SIZE, each at most MAX_BATCH_DELAY after its
+    first message arrived, so a burst of messages costs one transaction
+    and one thread hop instead of one per message.
+    """
+
+    def __init__(self):
+        # Each event loop gets its own queue and writer task, which live as
+        # long as the loop does; tests and async_to_sync run several loops
+        self._writers = weakref.WeakKeyDictionary()
+
+    async def save(self, room_id, sender_id, recipient_id, content):
+        """Queue a message and wait until it is committed; returns the saved Message"""
+        queue = self._ensure_task()
+        future = asyncio.get_running_loop().create_future()
+        message = Message(
+            room_id=room_id, sender_id=sender_id, recipient_id=recipient_id, content=content
+        )
+        await queue.put((message, future))
+        return await future
+
+    def _ensure_task(self):
+        """The running loop's queue, (re)starting its writer task if needed"""
+        loop = asyncio.get_running_loop()
+        queue, task = self._writers.get(loop, (None, None))
+        if queue is None:
+            queue = asyncio.Queue(MAX_PENDING_MESSAGES)
+        # A task that died leaves its queue, and the messages in it, to the next one
+        if task is None or task.done():
+            self._writers[loop] = (queue, loop.create_task(self._run(queue)))
+        return queue
+
+    async def _run(self, queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + MAX_BATCH_DELAY
+            while len(batch) < MAX_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Whatever is already queued rides along without waiting
+            while len(batch) < MAX_BATCH_SIZE and not queue.empty():
+                batch.append(queue.get_nowait())
+
+            await self._write(batch)
+
+    async def _write(self, batch):
+        messages = [message for message, _ in batch]
+        try:
+            saved = await database_sync_to_async(write_messages)(messages)
+        except Exception as e:
+            if len(batch) > 1:
+                # Retry one by one so a bad message only fails its own sender
+                for entry in batch:
+                    await self._write([entry])
+                return
+            logger.error(f"Error saving chat message: {str(e)}", exc_info=True)
+            _, future = batch[0]
+            if not future.done():
+                future.set_exception(e)
+            return
+        for message, (_, future) in zip(saved, batch):
+            if not future.done():
+                future.set_result(message)
+
+
+message_writer = MessageWriter()
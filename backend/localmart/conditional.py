@@ -0,0 +1,39 @@
+import hashlib
+import json
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+class ConditionalGetMixin:
+    """
+    Answers If-None-Match / If-Modified-Since with a 304 before the
+    response body is built.
+
+    Views implement get_validators(request, **kwargs), returning
+    (etag_parts, last_modified) from a cheap query, or None to skip.
+    `last_modified` may be None when it would not be exact.
+    """
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        validators = self.get_validators(request, **kwargs)
+        if validators is None:
+            return handler(request, *args, **kwargs)
+
+        parts, last_modified = validators
+        # Different renderers (JSON, browsable API) are different representations
+        parts = [request.accepted_renderer.format, parts]
+        digest = hashlib.sha1(json.dumps(parts, default=str).encode()).hexdigest()
+        etag = quote_etag(digest)
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if timestamp is not None:
+                response['Last-Modified'] = http_date(timestamp)
+        return response
+
+    def get_validators(self, request, **kwargs):
+        return None
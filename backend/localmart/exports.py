@@ -0,0 +1,55 @@
+import csv
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import ValidationError
+
+EXPORT_CHUNK_SIZE = 1000
+EXPORT_CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+class Echo:
+    """File-like object for csv.writer that hands each line back instead of storing it"""
+
+    def write(self, value):
+        return value
+
+
+def get_export_format(request):
+    """The requested ?output= export format, or None for a normal response"""
+    output = request.query_params.get('output')
+    if output is None:
+        return None
+    if output not in EXPORT_CONTENT_TYPES:
+        raise ValidationError({'output': f"Must be one of: {', '.join(EXPORT_CONTENT_TYPES)}"})
+    return output
+
+
+def stream_export(queryset, columns, output, filename):
+    """
+    Stream a queryset as CSV or NDJSON with constant memory.
+
+    `columns` maps output column names to queryset lookups. Rows come from
+    .values().iterator(), so neither model instances nor serializer output
+    for the whole queryset are ever held at once.
+    """
+    rows = queryset.values(*columns.values()).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+    def csv_lines():
+        writer = csv.writer(Echo())
+        yield writer.writerow(list(columns))
+        for row in rows:
+            yield writer.writerow([row[lookup] for lookup in columns.values()])
+
+    def ndjson_lines():
+        for row in rows:
+            record = {name: row[lookup] for name, lookup in columns.items()}
+            yield json.dumps(record, cls=DjangoJSONEncoder) + '\n'
+
+    lines = csv_lines() if output == 'csv' else ndjson_lines()
+    response = StreamingHttpResponse(lines, content_type=EXPORT_CONTENT_TYPES[output])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{output}"'
+    return response
@@ -0,0 +1,146 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import date, datetime
+from decimal import Decimal
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination keyed on the queryset's full ordering.
+
+    Each cursor stores the sort key of the row it points at, so every page
+    is a bounded index range read no matter how deep the client scrolls.
+    `id` is appended to the ordering as a tie-breaker when missing.
+    """
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = self.get_ordering(queryset)
+        limit = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+
+        reverse = bool(cursor and cursor['reverse'])
+        if cursor:
+            try:
+                queryset = queryset.filter(self.build_filter(cursor['position'], reverse))
+            except (TypeError, ValueError, ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+
+        ordering = [
+            (name, not descending) if reverse else (name, descending)
+            for name, descending in self.ordering
+        ]
+        queryset = queryset.order_by(
+            *[f'-{name}' if descending else name for name, descending in ordering]
+        )
+
+        rows = list(queryset[:limit + 1])
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if reverse:
+            rows.reverse()
+
+        self.has_next = True if reverse else has_more
+        self.has_previous = has_more if reverse else cursor is not None
+        self.page = rows
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_ordering(self, queryset):
+        ordering = list(queryset.query.order_by) or list(queryset.model._meta.ordering)
+        fields = []
+        for item in ordering:
+            if not isinstance(item, str):
+                raise TypeError('KeysetPagination only supports field name orderings')
+            descending = item.startswith('-')
+            name = item.lstrip('-')
+            fields.append(('id' if name == 'pk' else name, descending))
+
+        if not fields or fields[-1][0] != 'id':
+            fields = [field for field in fields if field[0] != 'id']
+            descending = fields[0][1] if fields else True
+            fields.append(('id', descending))
+        return fields
+
+    def build_filter(self, position, reverse):
+        """Rows strictly after `position` in the (possibly reversed) ordering"""
+        condition = Q()
+        for index, (name, descending) in enumerate(self.ordering):
+            lookup = 'gt' if descending == reverse else 'lt'
+            ties = {
+                previous: position[i] for i, (previous, _) in enumerate(self.ordering[:index])
+            }
+            condition |= Q(**ties, **{f'{name}__{lookup}': position[index]})
+        return condition
+
+    def get_position(self, obj):
+        position = []
+        for name, _ in self.ordering:
+            try:
+                name = obj._meta.get_field(name).attname
+            except FieldDoesNotExist:
+                pass
+            position.append(_encode_value(getattr(obj, name)))
+        return position
+
+    def encode_cursor(self, position, reverse):
+        payload = json.dumps({'p': position, 'r': reverse}, separators=(',', ':'))
+        token = urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, token)
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            payload = json.loads(urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+            position = payload['p']
+            reverse = bool(payload['r'])
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return {'position': position, 'reverse': reverse}
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.get_position(self.page[-1]), False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.get_position(self.page[0]), True)
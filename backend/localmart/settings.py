@@ -216,6 +216,22 @@ REST_FRAMEWORK = {
 
 AUTH_USER_MODEL = 'users.User'
 
+# Product search backend; defaults to FTS5 on SQLite and tsvector on Postgres
+PRODUCT_SEARCH_BACKEND = os.getenv('PRODUCT_SEARCH_BACKEND') or None
+
+# Seconds between flushes of buffered product views; None flushes inline
+PRODUCT_VIEW_FLUSH_INTERVAL = 10
+
+# Analytics rollups skip events younger than this many seconds, so rows from
+# transactions that commit out of id order aren't passed by the watermark
+PRODUCT_ROLLUP_SETTLE_DELAY = 60
+
+# Generate image thumbnails on a background thread; False does it inline
+PRODUCT_IMAGE_VARIANTS_ASYNC = True
+
+# Run bulk listing imports on a background thread; False runs them inline
+PRODUCT_IMPORT_ASYNC = True
+
 # Add these settings
 CORS_ALLOW_CREDENTIALS = True
 SESSION_COOKIE_SAMESITE = None  # For development only
@@ -249,11 +265,56 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 # Channel Layer Configuration
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer'
+# With REDIS_URL set, chat groups are shared by every ASGI worker and host
+# through Redis; without it the in-memory layer only reaches sockets in the
+# same process, which is fine for a single development server
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                # One pool per worker event loop, shared by all its sockets
+                'hosts': [{
+                    'address': REDIS_URL,
+                    'max_connections': int(os.getenv('CHANNEL_LAYER_MAX_CONNECTIONS', 50)),
+                }],
+                'prefix': 'localmart',
+                # Undelivered messages are dropped after this many seconds
+                'expiry': 60,
+                # Group memberships of workers that died without leaving
+                'group_expiry': 24 * 60 * 60,
+                # Per-channel backlog; group sends skip sockets that are this far behind
+                'capacity': 100,
+            },
+        }
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer'
+        }
+    }
+
+# Cache Configuration
+# The product response cache, its generation counter and the category tree
+# version must be visible to every worker, so with REDIS_URL set they live
+# in Redis. LocMem is per-process: only use it with a single server process,
+# otherwise other workers keep serving stale responses until they expire.
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'localmart',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
     }
-}
 
 # Update ASGI application
 ASGI_APPLICATION = 'localmart.routing.application'
@@ -296,4 +357,4 @@ CORS_ALLOW_HEADERS = [
     'x-requested-with',
 ]
 
-CORS_EXPOSE_HEADERS = ['content-type', 'content-disposition']
+CORS_EXPOSE_HEADERS = ['content-type', 'content-disposition', 'etag', 'last-modified']
@@ -0,0 +1,98 @@
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.http.multipartparser import MultiPartParserError
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import MultiPartParser
+
+MAX_IMAGE_SIZE = 5 * 1024 * 1024  # 5MB
+MAX_IMAGES_PER_REQUEST = 5
+# Room for the images plus the ordinary form fields
+MAX_REQUEST_SIZE = MAX_IMAGES_PER_REQUEST * MAX_IMAGE_SIZE + 1024 * 1024
+
+IMAGE_SIGNATURES = {
+    b'\xff\xd8\xff': 'image/jpeg',
+    b'\x89PNG\r\n\x1a\n': 'image/png',
+}
+SIGNATURE_LENGTH = max(len(signature) for signature in IMAGE_SIGNATURES)
+
+
+class UploadRejected(MultiPartParserError):
+    pass
+
+
+def detect_image_type(header):
+    for signature, content_type in IMAGE_SIGNATURES.items():
+        if header.startswith(signature):
+            return content_type
+    return None
+
+
+class ImageUploadHandler(TemporaryFileUploadHandler):
+    """
+    Streams image uploads straight to a temporary file in small chunks.
+
+    The JPEG/PNG signature is checked on the first bytes and the size limit
+    on every chunk, so a bad or oversized upload is rejected as soon as it
+    shows up rather than after the whole body has been received.
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.file_count = 0
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        if content_length and content_length > MAX_REQUEST_SIZE:
+            raise UploadRejected(
+                f'Request body cannot exceed {MAX_REQUEST_SIZE // (1024 * 1024)}MB'
+            )
+
+    def new_file(self, *args, **kwargs):
+        self.file_count += 1
+        if self.file_count > MAX_IMAGES_PER_REQUEST:
+            raise UploadRejected(f'At most {MAX_IMAGES_PER_REQUEST} images can be uploaded')
+        super().new_file(*args, **kwargs)
+        self.received = 0
+        self.header = b''
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > MAX_IMAGE_SIZE:
+            self.reject('Image size cannot exceed 5MB')
+        if len(self.header) < SIGNATURE_LENGTH:
+            self.header += raw_data[:SIGNATURE_LENGTH - len(self.header)]
+            if len(self.header) == SIGNATURE_LENGTH:
+                self.check_signature()
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        if len(self.header) < SIGNATURE_LENGTH:
+            self.check_signature()
+        return super().file_complete(file_size)
+
+    def check_signature(self):
+        content_type = detect_image_type(self.header)
+        if content_type is None:
+            self.reject('Only JPEG and PNG images are allowed')
+        # Trust the bytes, not the client's Content-Type
+        self.file.content_type = content_type
+
+    def reject(self, message):
+        # Closing the temporary file deletes what was spooled so far
+        self.file.close()
+        raise UploadRejected(message)
+
+
+class ImageMultiPartParser(MultiPartParser):
+    """Multipart parser that only accepts JPEG/PNG files via ImageUploadHandler"""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = parser_context['request']
+        request.upload_handlers = [ImageUploadHandler(request)]
+        try:
+            return super().parse(stream, media_type, parser_context)
+        except ParseError as exc:
+            # Report the rejection without DRF's "Multipart form parse error" prefix
+            if isinstance(exc.__context__, UploadRejected):
+                raise ParseError(str(exc.__context__))
+            raise
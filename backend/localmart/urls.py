@@ -16,7 +16,6 @@ router.register(r'wishlist', WishlistViewSet, basename='wishlist')
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include([
-        path('', include(router.urls)),
         # Auth endpoints
         path('auth/', include([
             path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
@@ -35,5 +34,7 @@ urlpatterns = [
         ])),
         # Chat endpoints
         path('chat/rooms/create/', ChatViewSet.as_view({'post': 'create_or_get_room'}), name='create-get-room'),
+        # Router last so explicit paths like products/my/ aren't taken as a pk
+        path('', include(router.urls)),
     ])),
 ]
@@ -0,0 +1,25 @@
+import hashlib
+import os
+
+CONTENT_TYPE_EXTENSIONS = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+}
+
+
+def hash_file(file):
+    """sha256 of an uploaded file, read in chunks"""
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def blob_name(digest, file):
+    """Content address of a file: identical bytes always map to the same name"""
+    extension = CONTENT_TYPE_EXTENSIONS.get(getattr(file, 'content_type', None))
+    if extension is None:
+        extension = os.path.splitext(file.name or '')[1].lower() or '.jpg'
+    return f'product_images/{digest[:2]}/{digest}{extension}'
@@ -0,0 +1,67 @@
+import hashlib
+from django.core.cache import cache
+
+# Responses, the generation and the counters live in the default cache,
+# which must be shared by all workers (Redis when REDIS_URL is set). With the
+# per-process LocMem fallback a write only retires the responses cached by
+# the process that made it.
+RESPONSE_CACHE_TIMEOUT = 300  # seconds
+# Every cached response key embeds the generation, so bumping it retires
+# all of them at once
+GENERATION_KEY = 'product_responses:generation'
+HITS_KEY = 'product_responses:hits'
+MISSES_KEY = 'product_responses:misses'
+
+
+def _incr(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, None)
+        return cache.incr(key)
+
+
+def get_generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, 1, None)
+        generation = cache.get(GENERATION_KEY, 1)
+    return generation
+
+
+def bump_generation():
+    _incr(GENERATION_KEY)
+
+
+def response_cache_key(request, action, pk=None):
+    params = sorted(
+        (key, value)
+        for key, values in request.query_params.lists()
+        for value in values
+    )
+    # Host is part of the key because image and cursor URLs are absolute
+    raw = f'{request.get_host()}|{action}|{pk or ""}|{params}'
+    digest = hashlib.md5(raw.encode()).hexdigest()
+    return f'product_responses:{get_generation()}:{digest}'
+
+
+def get_cached_response(key):
+    data = cache.get(key)
+    _incr(MISSES_KEY if data is None else HITS_KEY)
+    return data
+
+
+def set_cached_response(key, data):
+    cache.set(key, data, RESPONSE_CACHE_TIMEOUT)
+
+
+def get_cache_stats():
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / total, 4) if total else None,
+        'generation': get_generation(),
+    }
@@ -0,0 +1,57 @@
+import threading
+from django.core.cache import cache
+from django.db.models import Count, Max
+from .models import Category
+
+# Caches the version derived from the categories table. Deleted on every
+# Category change; other processes that can't see the delete (a
+# per-process cache) pick the change up once it expires.
+VERSION_KEY = 'category_tree_version'
+VERSION_TIMEOUT = 60  # seconds
+
+_lock = threading.Lock()
+_tree = {'version': None, 'nodes': [], 'by_id': {}}
+
+
+def invalidate_category_tree():
+    cache.delete(VERSION_KEY)
+    with _lock:
+        _tree['version'] = None
+
+
+def build_category_tree():
+    """Serialize every active category with its nested children from one query"""
+    from .serializers import CategorySerializer
+
+    categories = list(Category.objects.filter(is_active=True))
+    children = {}
+    for category in categories:
+        children.setdefault(category.parent_id, []).append(category)
+
+    nodes = CategorySerializer(categories, many=True, context={'children': children}).data
+    return nodes, {node['id']: node for node in nodes}
+
+
+def get_category_tree_version():
+    """Changes whenever a category is added, edited or deleted"""
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        stats = Category.objects.aggregate(count=Count('id'), last_updated=Max('updated_at'))
+        last_updated = stats['last_updated'].isoformat() if stats['last_updated'] else ''
+        version = f"{stats['count']}:{last_updated}"
+        cache.set(VERSION_KEY, version, VERSION_TIMEOUT)
+    return version
+
+
+def get_category_tree():
+    """Returns (nodes, nodes_by_id), rebuilding after any Category change"""
+    version = get_category_tree_version()
+
+    with _lock:
+        if _tree['version'] == version:
+            return _tree['nodes'], _tree['by_id']
+
+    nodes, by_id = build_category_tree()
+    with _lock:
+        _tree.update(version=version, nodes=nodes, by_id=by_id)
+    return nodes, by_id
@@ -0,0 +1,37 @@
+import time
+from django.db import transaction
+from django.utils import timezone
+from .cache import bump_generation
+from .models import Product
+
+EXPIRY_BATCH_SIZE = 500
+
+
+def expire_listings(batch_size=EXPIRY_BATCH_SIZE, pause=0, now=None):
+    """
+    Deactivate listings whose expiry_date has passed, batch by batch.
+
+    Each batch is picked with a range read on the partial expiry index
+    and deactivated in its own short transaction, so no lock is held
+    across the whole sweep. Returns the number of listings deactivated.
+    """
+    now = now or timezone.now()
+    expired = 0
+    while True:
+        product_ids = list(
+            Product.objects.filter(is_active=True, expiry_date__lte=now)
+            .order_by('expiry_date').values_list('id', flat=True)[:batch_size]
+        )
+        if not product_ids:
+            break
+        with transaction.atomic():
+            # is_active is re-checked in case a seller changed the listing meanwhile
+            expired += Product.objects.filter(
+                pk__in=product_ids, is_active=True, expiry_date__lte=now
+            ).update(is_active=False, updated_at=timezone.now())
+        bump_generation()
+        if len(product_ids) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+    return expired
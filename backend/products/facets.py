@@ -0,0 +1,89 @@
+import hashlib
+import json
+from django.core.cache import cache
+from django.db.models import Case, Count, IntegerField, Value, When
+from .models import Product
+
+FACETS_CACHE_TIMEOUT = 60  # seconds
+# Query params that change facet counts; paging/sorting/rendering ones don't
+FACET_PARAMS = [
+    'category', 'condition', 'location', 'min_price', 'max_price',
+    'is_urgent', 'search', 'near', 'radius_km',
+]
+# Upper bounds of the price buckets; the last bucket is open-ended
+PRICE_BUCKETS = [500, 1000, 5000, 10000, 50000]
+
+
+def facets_cache_key(query_params):
+    normalized = {}
+    for param in FACET_PARAMS:
+        value = ' '.join(query_params.get(param, '').split()).lower()
+        if value:
+            normalized[param] = value
+    digest = hashlib.md5(json.dumps(normalized, sort_keys=True).encode()).hexdigest()
+    return f'product_facets:{digest}'
+
+
+def price_bucket():
+    return Case(
+        *[When(price__lt=bound, then=Value(index)) for index, bound in enumerate(PRICE_BUCKETS)],
+        default=Value(len(PRICE_BUCKETS)),
+        output_field=IntegerField()
+    )
+
+
+def compute_facets(queryset):
+    """
+    Count products per category, condition, urgency and price bucket.
+
+    A single GROUP BY over all four dimensions returns at most
+    categories x conditions x 2 x buckets rows, which are then summed per
+    dimension in Python.
+    """
+    rows = queryset.order_by().select_related(None).prefetch_related(None).annotate(
+        price_bucket=price_bucket()
+    ).values(
+        'category', 'category__name', 'condition', 'is_urgent', 'price_bucket'
+    ).annotate(count=Count('id'))
+
+    total = 0
+    categories = {}
+    conditions = {}
+    urgency = {'true': 0, 'false': 0}
+    buckets = [0] * (len(PRICE_BUCKETS) + 1)
+    for row in rows:
+        count = row['count']
+        total += count
+        if row['category'] is not None:
+            category = categories.setdefault(
+                row['category'], {'id': row['category'], 'name': row['category__name'], 'count': 0}
+            )
+            category['count'] += count
+        conditions[row['condition']] = conditions.get(row['condition'], 0) + count
+        urgency['true' if row['is_urgent'] else 'false'] += count
+        buckets[row['price_bucket']] += count
+
+    bounds = [0] + PRICE_BUCKETS + [None]
+    return {
+        'total': total,
+        'categories': sorted(categories.values(), key=lambda c: (-c['count'], c['name'])),
+        'conditions': [
+            {'value': value, 'label': label, 'count': conditions.get(value, 0)}
+            for value, label in Product.CONDITION_CHOICES
+        ],
+        'is_urgent': urgency,
+        'price_ranges': [
+            {'min': bounds[index], 'max': bounds[index + 1], 'count': count}
+            for index, count in enumerate(buckets)
+        ],
+    }
+
+
+def get_facets(queryset, query_params):
+    """Facet counts for the filtered queryset, cached briefly per filter set"""
+    key = facets_cache_key(query_params)
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute_facets(queryset)
+        cache.set(key, facets, FACETS_CACHE_TIMEOUT)
+    return facets
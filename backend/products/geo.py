@@ -0,0 +1,133 @@
+import math
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import ASin, Cos, Least, Power, Radians, Sin, Sqrt
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9
+# Upper bound on geohash ranges ORed together by a radius query
+MAX_COVER_CELLS = 16
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(geohash) < precision:
+        if even:
+            value, value_range = longitude, lng_range
+        else:
+            value, value_range = latitude, lat_range
+        mid = (value_range[0] + value_range[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            value_range[0] = mid
+        else:
+            bits = bits << 1
+            value_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(geohash)
+
+
+def cell_size(precision):
+    """(lat_degrees, lng_degrees) covered by a geohash of this length"""
+    lng_bits = math.ceil(precision * 5 / 2)
+    lat_bits = precision * 5 - lng_bits
+    return 180 / 2 ** lat_bits, 360 / 2 ** lng_bits
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """(south, north, west, east); west > east when crossing the antimeridian,
+    and the longitude span is None when the box reaches a pole."""
+    lat_delta = radius_km / KM_PER_DEGREE
+    south = max(latitude - lat_delta, -90.0)
+    north = min(latitude + lat_delta, 90.0)
+    if south == -90.0 or north == 90.0:
+        return south, north, None, None
+
+    lng_delta = lat_delta / math.cos(math.radians(latitude))
+    if lng_delta >= 180:
+        return south, north, None, None
+    west = (longitude - lng_delta + 180) % 360 - 180
+    east = (longitude + lng_delta + 180) % 360 - 180
+    return south, north, west, east
+
+
+def _steps(start, end, step):
+    value = start
+    while value < end:
+        yield value
+        value += step
+    yield end
+
+
+def covering_geohashes(latitude, longitude, radius_km):
+    """Geohash prefixes whose cells together cover the radius' bounding box,
+    or None when the area is too large for prefix ranges to help."""
+    south, north, west, east = bounding_box(latitude, longitude, radius_km)
+    if west is None:
+        return None
+    lng_span = (east - west) % 360
+
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        lat_step, lng_step = cell_size(precision)
+        cells = (math.ceil((north - south) / lat_step) + 1) * (math.ceil(lng_span / lng_step) + 1)
+        if cells > MAX_COVER_CELLS:
+            continue
+        return {
+            encode_geohash(lat, (west + offset + 180) % 360 - 180, precision)
+            for lat in _steps(south, north, lat_step)
+            for offset in _steps(0, lng_span, lng_step)
+        }
+    return None
+
+
+def haversine_distance(latitude, longitude):
+    """Great-circle distance in km from the given point to each row"""
+    lat = Value(math.radians(latitude))
+    lng = Value(math.radians(longitude))
+    half_chord = (
+        Power(Sin((Radians(F('latitude')) - lat) / 2), 2) +
+        Cos(lat) * Cos(Radians(F('latitude'))) *
+        Power(Sin((Radians(F('longitude')) - lng) / 2), 2)
+    )
+    return Value(2 * EARTH_RADIUS_KM) * ASin(
+        Least(Sqrt(half_chord), Value(1.0)), output_field=FloatField()
+    )
+
+
+def filter_nearby(queryset, latitude, longitude, radius_km):
+    """
+    Restrict to rows within `radius_km`, annotated with `distance`.
+
+    Candidates are narrowed with indexed geohash ranges and a
+    latitude/longitude bounding box before the exact haversine check.
+    """
+    prefixes = covering_geohashes(latitude, longitude, radius_km)
+    if prefixes:
+        cells = Q()
+        for prefix in sorted(prefixes):
+            cells |= Q(geohash__gte=prefix, geohash__lt=prefix + '~')
+        queryset = queryset.filter(cells)
+
+    south, north, west, east = bounding_box(latitude, longitude, radius_km)
+    queryset = queryset.filter(latitude__gte=south, latitude__lte=north)
+    if west is not None:
+        if west <= east:
+            queryset = queryset.filter(longitude__gte=west, longitude__lte=east)
+        else:
+            queryset = queryset.filter(Q(longitude__gte=west) | Q(longitude__lte=east))
+
+    return queryset.annotate(
+        distance=haversine_distance(latitude, longitude)
+    ).filter(distance__lte=radius_km)
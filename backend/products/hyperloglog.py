@@ -0,0 +1,47 @@
+import hashlib
+import math
+
+
+class HyperLogLog:
+    """
+    Fixed-size cardinality sketch for counting distinct viewers.
+
+    With the default precision of 10 it uses 1024 one-byte registers and
+    estimates within roughly 3% regardless of how many viewers are added.
+    Sketches merge by taking the per-register maximum.
+    """
+
+    def __init__(self, registers=None, precision=10):
+        self.precision = precision
+        self.size = 1 << precision
+        if registers and len(registers) == self.size:
+            self.registers = bytearray(registers)
+        else:
+            self.registers = bytearray(self.size)
+
+    def add(self, value):
+        digest = hashlib.blake2b(str(value).encode(), digest_size=8).digest()
+        hashed = int.from_bytes(digest, 'big')
+        index = hashed >> (64 - self.precision)
+        remaining = hashed & ((1 << (64 - self.precision)) - 1)
+        # Position of the leftmost 1-bit in the remaining bits
+        rank = (64 - self.precision) - remaining.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        for index, value in enumerate(other.registers):
+            if value > self.registers[index]:
+                self.registers[index] = value
+
+    def count(self):
+        alpha = 0.7213 / (1 + 1.079 / self.size)
+        estimate = alpha * self.size ** 2 / sum(2.0 ** -value for value in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.size and zeros:
+            # Linear counting is more accurate for small cardinalities
+            estimate = self.size * math.log(self.size / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self):
+        return bytes(self.registers)
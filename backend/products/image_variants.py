@@ -0,0 +1,134 @@
+import logging
+import queue
+import threading
+from io import BytesIO
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections
+from PIL import Image, ImageOps
+from .models import ImageBlob, ProductImage
+
+logger = logging.getLogger(__name__)
+
+# Longest edge in pixels; originals smaller than a size are not upscaled
+VARIANT_SIZES = {
+    'thumbnail': 320,
+    'medium': 1024,
+}
+JPEG_QUALITY = 80
+WEBP_QUALITY = 75
+
+
+def encode(image, format, **options):
+    # No exif= argument: the saved file carries no EXIF/GPS metadata
+    buffer = BytesIO()
+    image.save(buffer, format=format, optimize=True, **options)
+    return ContentFile(buffer.getvalue())
+
+
+def render_variants(product_image, prefix):
+    """Write JPEG and WebP copies of the original at every VARIANT_SIZES size"""
+    storage = product_image.image.storage
+    with product_image.image.open('rb') as original:
+        with Image.open(original) as source:
+            # Apply the EXIF orientation before the metadata is dropped
+            source = ImageOps.exif_transpose(source)
+            icc_profile = source.info.get('icc_profile')
+            if source.mode != 'RGB':
+                source = source.convert('RGB')
+
+            variants = {}
+            for size, edge in VARIANT_SIZES.items():
+                resized = source.copy()
+                resized.thumbnail((edge, edge), Image.LANCZOS)
+                base = f'product_images/variants/{prefix}-{size}'
+                variant = {'width': resized.width, 'height': resized.height}
+                variant['jpeg'] = storage.save(
+                    f'{base}.jpg',
+                    encode(resized, 'JPEG', quality=JPEG_QUALITY, progressive=True, icc_profile=icc_profile)
+                )
+                variant['webp'] = storage.save(
+                    f'{base}.webp',
+                    encode(resized, 'WEBP', quality=WEBP_QUALITY, icc_profile=icc_profile)
+                )
+                variants[size] = variant
+    return variants
+
+
+def generate_variants(product_image):
+    """
+    Record the variants of an image on its ProductImage. Variants belong to
+    the image's blob, so identical bytes are only ever resized once.
+    """
+    blob = product_image.blob
+    if blob is not None and blob.variants:
+        variants = blob.variants
+    elif blob is not None:
+        variants = render_variants(product_image, blob.sha256)
+        ImageBlob.objects.filter(pk=blob.pk).update(variants=variants)
+    else:
+        variants = render_variants(product_image, product_image.pk)
+
+    product_image.variants = variants
+    product_image.variant_status = 'ready'
+    # Goes through save() so the signals move the product's ETag and cache
+    product_image.save(update_fields=['variants', 'variant_status'])
+    return variants
+
+
+def process_image(image_id):
+    product_image = ProductImage.objects.select_related('blob').filter(pk=image_id).first()
+    if product_image is None:
+        return
+    try:
+        generate_variants(product_image)
+    except Exception as e:
+        logger.error(f"Error generating variants for image {image_id}: {str(e)}", exc_info=True)
+        ProductImage.objects.filter(pk=image_id).update(variant_status='failed')
+
+
+class VariantWorker:
+    """
+    Background thread that generates image variants off the request path.
+
+    Image ids are queued once the upload transaction commits; images that
+    were never processed (e.g. queued when the process died) are picked up
+    by the generate_image_variants command.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def run_async(self):
+        return getattr(settings, 'PRODUCT_IMAGE_VARIANTS_ASYNC', True)
+
+    def enqueue(self, image_id):
+        if not self.run_async:
+            process_image(image_id)
+            return
+        self._ensure_thread()
+        self._queue.put(image_id)
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='product-image-variants', daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            image_id = self._queue.get()
+            close_old_connections()
+            try:
+                process_image(image_id)
+            finally:
+                close_old_connections()
+                self._queue.task_done()
+
+
+variant_worker = VariantWorker()
@@ -0,0 +1,197 @@
+import csv
+import io
+import json
+import logging
+import threading
+from datetime import timedelta
+from itertools import islice
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from .cache import bump_generation
+from .models import Category, ImportJob, Product
+from .search import get_search_backend
+from .serializers import ProductSerializer
+
+logger = logging.getLogger(__name__)
+
+IMPORT_CHUNK_SIZE = 500
+# A running job whose worker hasn't finished a chunk for this long is resumable
+IMPORT_CLAIM_TIMEOUT = timedelta(minutes=10)
+# Per-row errors kept on the job; error_count still counts all of them
+MAX_REPORTED_ERRORS = 1000
+FILE_EXTENSIONS = {
+    '.csv': 'csv',
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+}
+
+
+class ImportJobLost(Exception):
+    """Another worker claimed the job after this one's claim went stale"""
+
+
+class ProductImportSerializer(ProductSerializer):
+    """The ProductSerializer rules for the columns an import row may set"""
+    images = None
+    seller_name = None
+    category_name = None
+
+    class Meta(ProductSerializer.Meta):
+        fields = [
+            'title', 'description', 'price', 'condition', 'quantity', 'expiry_date',
+            'is_urgent', 'is_negotiable', 'location', 'latitude', 'longitude',
+        ]
+
+
+def detect_format(filename):
+    for extension, file_format in FILE_EXTENSIONS.items():
+        if filename.lower().endswith(extension):
+            return file_format
+    return None
+
+
+def read_rows(file, file_format):
+    """Yield rows as dicts, or None for an NDJSON line that isn't a JSON object"""
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    if file_format == 'csv':
+        for row in csv.DictReader(text):
+            # Empty cells mean "not given", not an empty string
+            yield {key: value for key, value in row.items() if key and value not in ('', None)}
+        return
+    for line in text:
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield row if isinstance(row, dict) else None
+
+
+def build_product(row, seller, category_ids):
+    """An unsaved Product for a valid row, or (None, errors)"""
+    if row is None:
+        return None, {'row': ['Must be a JSON object']}
+    row = dict(row)
+    category = row.pop('category', None)
+    errors = {}
+    if category is not None:
+        try:
+            category = int(category)
+        except (TypeError, ValueError):
+            category = None
+        if category not in category_ids:
+            errors['category'] = ['Unknown category']
+
+    serializer = ProductImportSerializer(data=row)
+    if not serializer.is_valid():
+        errors.update(serializer.errors)
+    if errors:
+        return None, errors
+
+    product = Product(seller=seller, category_id=category, **serializer.validated_data)
+    product.update_geohash()
+    product.update_popularity_score()
+    return product, None
+
+
+def import_chunk(job, chunk, category_ids):
+    products, errors = [], []
+    for number, row in chunk:
+        product, row_errors = build_product(row, job.seller, category_ids)
+        if product is None:
+            errors.append({'row': number, 'errors': row_errors})
+        else:
+            products.append(product)
+
+    # Rows and progress commit together, so a resumed job never inserts a row twice
+    with transaction.atomic():
+        # Renews the claim, and locks the job until the chunk commits
+        now = timezone.now()
+        if not ImportJob.objects.filter(pk=job.pk, claimed_at=job.claimed_at).update(claimed_at=now):
+            raise ImportJobLost(f'Import job {job.pk} was claimed by another worker')
+        job.claimed_at = now
+        created = Product.objects.bulk_create(products)
+        # bulk_create skips the post_save receivers that index products
+        get_search_backend().index_products(created)
+        job.processed_rows += len(chunk)
+        job.created_count += len(created)
+        job.error_count += len(errors)
+        job.errors = (job.errors + errors)[:MAX_REPORTED_ERRORS]
+        job.save(update_fields=[
+            'processed_rows', 'created_count', 'error_count', 'errors', 'claimed_at', 'updated_at'
+        ])
+    bump_generation()
+
+
+def claim_import(job_id, stale_after=None):
+    """
+    Atomically mark a job running for this worker. Pending jobs can always
+    be claimed; running ones only once their claim is older than
+    `stale_after`. Returns the claimed job, or None.
+    """
+    now = timezone.now()
+    claimable = Q(status='pending')
+    if stale_after is not None:
+        claimable |= Q(status='running') & (
+            Q(claimed_at__isnull=True) | Q(claimed_at__lt=now - stale_after)
+        )
+    if not ImportJob.objects.filter(claimable, pk=job_id).update(status='running', claimed_at=now):
+        return None
+    return ImportJob.objects.select_related('seller').get(pk=job_id)
+
+
+def run_import(job_id, stale_after=None):
+    """
+    Process an import job from where it left off; see claim_import() for
+    which jobs are taken. Returns the job, or None if it wasn't claimed.
+    """
+    job = claim_import(job_id, stale_after)
+    if job is None:
+        return None
+
+    category_ids = set(Category.objects.filter(is_active=True).values_list('id', flat=True))
+    try:
+        with job.file.open('rb') as file:
+            # Row numbers count data rows from 1, whatever the format
+            rows = enumerate(read_rows(file, job.file_format), start=1)
+            rows = islice(rows, job.processed_rows, None)
+            while chunk := list(islice(rows, IMPORT_CHUNK_SIZE)):
+                import_chunk(job, chunk, category_ids)
+    except ImportJobLost as e:
+        logger.error(str(e))
+        return None
+    except Exception as e:
+        logger.error(f"Error importing products for job {job.pk}: {str(e)}", exc_info=True)
+        job.status = 'failed'
+        job.failure = str(e)
+    else:
+        job.status = 'completed'
+    job.finished_at = timezone.now()
+    # Only the worker still holding the claim records the outcome
+    ImportJob.objects.filter(pk=job.pk, claimed_at=job.claimed_at).update(
+        status=job.status, failure=job.failure, finished_at=job.finished_at, updated_at=job.finished_at
+    )
+    return job
+
+
+def _run_in_background(job_id):
+    try:
+        run_import(job_id)
+    finally:
+        close_old_connections()
+
+
+def start_import(job):
+    """Run the job once the transaction that created it commits"""
+    def start():
+        if getattr(settings, 'PRODUCT_IMPORT_ASYNC', True):
+            threading.Thread(
+                target=_run_in_background, args=(job.pk,), name=f'product-import-{job.pk}', daemon=True
+            ).start()
+        else:
+            run_import(job.pk)
+
+    transaction.on_commit(start)
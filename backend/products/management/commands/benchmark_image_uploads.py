@@ -0,0 +1,84 @@
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from products.models import Product, ProductImage
+from products.uploads import add_product_images, stage_images
+from users.models import User
+
+class LatencyStorage(FileSystemStorage):
+    """Local stand-in for S3/MinIO: every write pays a network round trip"""
+
+    def __init__(self, latency, **kwargs):
+        self.latency = latency
+        super().__init__(**kwargs)
+
+    def _save(self, name, content):
+        time.sleep(self.latency)
+        return super()._save(name, content)
+
+class Rollback(Exception):
+    pass
+
+class Command(BaseCommand):
+    help = 'Benchmarks serial image uploads against the concurrent bulk path used by create'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', type=int, default=10)
+        parser.add_argument('--size-kb', type=int, default=500)
+        parser.add_argument('--latency-ms', type=int, default=80)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        field = ProductImage._meta.get_field('image')
+        original_storage = field.storage
+        location = tempfile.mkdtemp()
+        field.storage = LatencyStorage(options['latency_ms'] / 1000, location=location)
+        try:
+            serial_ms = self.measure(self.serial_upload, options)
+            concurrent_ms = self.measure(self.concurrent_upload, options)
+        finally:
+            field.storage = original_storage
+            shutil.rmtree(location)
+
+        self.stdout.write(
+            f"{options['images']} images, {options['latency_ms']} ms per write  "
+            f"serial: {serial_ms:8.1f} ms  concurrent: {concurrent_ms:8.1f} ms  "
+            f"({serial_ms / max(concurrent_ms, 0.001):.1f}x)"
+        )
+
+    def serial_upload(self, product, files):
+        # What create did before: one blocking upload and INSERT per image
+        for index, image in enumerate(files):
+            ProductImage.objects.create(product=product, image=image, is_primary=index == 0)
+
+    def concurrent_upload(self, product, files):
+        add_product_images(product, stage_images(files))
+
+    def measure(self, upload, options):
+        timings = []
+        for _ in range(options['repeat']):
+            files = [
+                ContentFile(os.urandom(options['size_kb'] * 1024), name=f'photo-{index}.jpg')
+                for index in range(options['images'])
+            ]
+            try:
+                # Nothing the benchmark creates is kept
+                with transaction.atomic():
+                    seller = User.objects.create_user(email='benchmark@example.com', password=None)
+                    product = Product.objects.create(
+                        seller=seller, title='Benchmark listing', description='Benchmark',
+                        price=1, condition='good', location='Benchmark'
+                    )
+                    start = time.perf_counter()
+                    upload(product, files)
+                    timings.append((time.perf_counter() - start) * 1000)
+                    raise Rollback
+            except Rollback:
+                pass
+        return statistics.median(timings)
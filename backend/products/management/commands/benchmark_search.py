@@ -0,0 +1,100 @@
+import random
+import sqlite3
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from products.search import SQLiteSearchBackend, TITLE_WEIGHT, DESCRIPTION_WEIGHT
+
+WORDS = [
+    'phone', 'laptop', 'charger', 'cable', 'sofa', 'table', 'chair', 'lamp',
+    'bike', 'helmet', 'shoes', 'jacket', 'shirt', 'dress', 'watch', 'camera',
+    'lens', 'tripod', 'guitar', 'piano', 'book', 'novel', 'desk', 'mirror',
+    'kettle', 'blender', 'oven', 'fridge', 'bed', 'mattress', 'pillow', 'rug',
+    'racket', 'ball', 'bat', 'gloves', 'tent', 'backpack', 'bottle', 'speaker',
+]
+ADJECTIVES = [
+    'used', 'new', 'vintage', 'black', 'white', 'wooden', 'leather', 'small',
+    'large', 'portable', 'wireless', 'classic', 'premium', 'cheap', 'sturdy',
+]
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'ze', 'pa', 'do', 'gu']
+QUERIES = ['phone', 'wireless speaker', 'vintage lea', 'wooden desk', 'camera lens', 'kettle']
+
+class Command(BaseCommand):
+    help = 'Benchmarks FTS5 product search against the icontains scan'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[100000, 1000000])
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        for size in options['sizes']:
+            conn = self.build_database(size)
+            like_ms = self.measure(conn, self.like_search, options['repeat'])
+            fts_ms = self.measure(conn, self.fts_search, options['repeat'])
+            conn.close()
+            self.stdout.write(
+                f"{size:>9} listings  icontains: {like_ms:9.2f} ms  "
+                f"fts5: {fts_ms:7.2f} ms  ({like_ms / max(fts_ms, 0.001):.0f}x)"
+            )
+
+    def build_database(self, size):
+        rng = random.Random(size)
+        # Real listings draw on a long-tail vocabulary, so pad the product
+        # words with generated filler terms
+        filler = [
+            ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+            for _ in range(20000)
+        ]
+        conn = sqlite3.connect(':memory:')
+        conn.execute(
+            'CREATE TABLE products (id INTEGER PRIMARY KEY, title TEXT, '
+            'description TEXT, is_active BOOL, created_at REAL)'
+        )
+
+        def rows():
+            for pk in range(1, size + 1):
+                title = f"{rng.choice(ADJECTIVES)} {rng.choice(WORDS)} {rng.choice(filler)}"
+                description = ' '.join(
+                    rng.choice(WORDS + ADJECTIVES) if rng.random() < 0.05 else rng.choice(filler)
+                    for _ in range(rng.randint(15, 40))
+                )
+                yield pk, title, description, True, float(pk)
+
+        conn.executemany('INSERT INTO products VALUES (?, ?, ?, ?, ?)', rows())
+        backend = SQLiteSearchBackend()
+        conn.execute(
+            f"CREATE VIRTUAL TABLE {backend.table} "
+            f"USING fts5(title, description, tokenize='unicode61 remove_diacritics 2')"
+        )
+        conn.execute(
+            f"INSERT INTO {backend.table}(rowid, title, description) "
+            f"SELECT id, title, description FROM products"
+        )
+        conn.commit()
+        return conn
+
+    def like_search(self, conn, query):
+        pattern = f'%{query}%'
+        return conn.execute(
+            'SELECT id FROM products WHERE is_active AND '
+            '(title LIKE ? OR description LIKE ?) ORDER BY created_at DESC LIMIT 20',
+            (pattern, pattern)
+        ).fetchall()
+
+    def fts_search(self, conn, query):
+        backend = SQLiteSearchBackend()
+        return conn.execute(
+            f'SELECT products.id FROM products, {backend.table} '
+            f'WHERE {backend.table}.rowid = products.id AND {backend.table} MATCH ? '
+            f'AND products.is_active ORDER BY bm25({backend.table}, ?, ?) LIMIT 20',
+            (backend.build_match(query), TITLE_WEIGHT, DESCRIPTION_WEIGHT)
+        ).fetchall()
+
+    def measure(self, conn, search, repeat):
+        timings = []
+        for _ in range(repeat):
+            for query in QUERIES:
+                start = time.perf_counter()
+                search(conn, query)
+                timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from products.models import ImageBlob
+
+class Command(BaseCommand):
+    help = 'Deletes stored images (and their variants) that no listing references any more'
+
+    def handle(self, *args, **kwargs):
+        deleted = ImageBlob.objects.collect_garbage()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} unreferenced images'))
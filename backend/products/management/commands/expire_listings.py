@@ -0,0 +1,22 @@
+import time
+from django.core.management.base import BaseCommand
+from products.expiry import EXPIRY_BATCH_SIZE, expire_listings
+
+class Command(BaseCommand):
+    help = 'Deactivates listings past their expiry date'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=EXPIRY_BATCH_SIZE)
+        parser.add_argument('--pause', type=float, default=0.1, help='Seconds to wait between batches')
+        parser.add_argument(
+            '--interval', type=int, default=0,
+            help='Keep running and sweep every INTERVAL seconds instead of once'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            expired = expire_listings(options['batch_size'], options['pause'])
+            self.stdout.write(self.style.SUCCESS(f'Deactivated {expired} expired listings'))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
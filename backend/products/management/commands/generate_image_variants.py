@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from products.image_variants import process_image
+from products.models import ProductImage
+
+class Command(BaseCommand):
+    help = 'Generates thumbnail and medium variants for images that do not have them yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retry-failed', action='store_true', help='Also retry failed images')
+
+    def handle(self, *args, **options):
+        statuses = ['pending', 'failed'] if options['retry_failed'] else ['pending']
+        image_ids = list(
+            ProductImage.objects.filter(variant_status__in=statuses).values_list('id', flat=True)
+        )
+        for image_id in image_ids:
+            process_image(image_id)
+        self.stdout.write(self.style.SUCCESS(f'Processed {len(image_ids)} images'))
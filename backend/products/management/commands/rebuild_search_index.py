@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from products.search import get_search_backend
+
+class Command(BaseCommand):
+    help = 'Rebuilds the product full-text search index'
+
+    def handle(self, *args, **kwargs):
+        get_search_backend().rebuild()
+        self.stdout.write(self.style.SUCCESS('Successfully rebuilt search index'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from products.cache import bump_generation
+from products.models import Product
+
+class Command(BaseCommand):
+    help = (
+        'Recomputes the popularity score of every active listing. rollup_analytics keeps '
+        'scores current; this is for backfills and changes to the ranking weights'
+    )
+
+    def handle(self, *args, **options):
+        rescored = Product.objects.filter(is_active=True).refresh_popularity()
+        bump_generation()
+        self.stdout.write(self.style.SUCCESS(f'Rescored {rescored} listings'))
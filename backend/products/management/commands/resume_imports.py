@@ -0,0 +1,38 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from products.imports import IMPORT_CLAIM_TIMEOUT, run_import
+from products.models import ImportJob
+
+class Command(BaseCommand):
+    help = (
+        'Resumes product imports interrupted by a restart. Running jobs are only taken over '
+        'once their worker has made no progress for --stale-after seconds.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retry-failed', action='store_true', help='Also retry failed jobs')
+        parser.add_argument(
+            '--stale-after', type=int, default=int(IMPORT_CLAIM_TIMEOUT.total_seconds()),
+            help='Seconds without progress after which a running job is considered abandoned'
+        )
+
+    def handle(self, *args, **options):
+        if options['retry_failed']:
+            ImportJob.objects.filter(status='failed').update(status='pending', failure='')
+        stale_after = timedelta(seconds=options['stale_after'])
+        job_ids = list(
+            ImportJob.objects.filter(status__in=['pending', 'running'])
+            .order_by('created_at').values_list('id', flat=True)
+        )
+        processed = 0
+        for job_id in job_ids:
+            # Claimed atomically, so jobs another worker still owns are skipped
+            job = run_import(job_id, stale_after)
+            if job is None:
+                self.stdout.write(f'Job {job_id}: skipped, owned by another worker')
+                continue
+            processed += 1
+            self.stdout.write(
+                f'Job {job.pk}: {job.status}, {job.created_count} created, {job.error_count} errors'
+            )
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} import jobs'))
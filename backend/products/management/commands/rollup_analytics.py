@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from products.rollups import ROLLUP_BATCH_SIZE, roll_up
+
+class Command(BaseCommand):
+    help = 'Rolls up new product views, wishlist adds and messages into hourly and daily buckets'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=ROLLUP_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        rolled_up = roll_up(options['batch_size'])
+        summary = ', '.join(f'{count} {source}' for source, count in rolled_up.items())
+        self.stdout.write(self.style.SUCCESS(f'Rolled up {summary}'))
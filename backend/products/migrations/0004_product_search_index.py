@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+def install_search_index(apps, schema_editor):
+    from products.search import get_search_backend
+    get_search_backend(schema_editor.connection).install(schema_editor)
+
+
+def uninstall_search_index(apps, schema_editor):
+    from products.search import get_search_backend
+    get_search_backend(schema_editor.connection).uninstall(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0003_alter_productimage_options_alter_productimage_image_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:26
+
+from django.db import migrations, models
+from products.geo import encode_geohash
+
+
+def populate_geohash(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    products = Product.objects.filter(latitude__isnull=False, longitude__isnull=False)
+    for product in products.iterator():
+        product.geohash = encode_geohash(product.latitude, product.longitude)
+        product.save(update_fields=['geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=12),
+        ),
+        migrations.RunPython(populate_geohash, migrations.RunPython.noop),
+    ]
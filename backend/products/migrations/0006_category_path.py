@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:32
+
+from django.db import migrations, models
+
+
+def populate_paths(apps, schema_editor):
+    Category = apps.get_model('products', 'Category')
+    parents = dict(Category.objects.values_list('id', 'parent_id'))
+
+    def path_of(category_id):
+        ancestors = []
+        while category_id is not None and category_id not in ancestors:
+            ancestors.append(category_id)
+            category_id = parents.get(category_id)
+        return ''.join(f'{ancestor}/' for ancestor in reversed(ancestors))
+
+    for category_id in parents:
+        path = path_of(category_id)
+        Category.objects.filter(id=category_id).update(path=path, depth=path.count('/') - 1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_product_geohash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(populate_paths, migrations.RunPython.noop),
+    ]
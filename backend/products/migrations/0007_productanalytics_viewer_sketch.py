@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_category_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productanalytics',
+            name='viewer_sketch',
+            field=models.BinaryField(default=b''),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_productanalytics_viewer_sketch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=20, unique=True)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'rollup_watermarks',
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductStatBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('bucket_start', models.DateTimeField()),
+                ('views', models.IntegerField(default=0)),
+                ('wishlist_adds', models.IntegerField(default=0)),
+                ('messages', models.IntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stat_buckets', to='products.product')),
+            ],
+            options={
+                'db_table': 'product_stat_buckets',
+                'ordering': ['bucket_start'],
+                'unique_together': {('product', 'granularity', 'bucket_start')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0015_category_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
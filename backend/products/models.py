@@ -1,8 +1,20 @@
-from django.db import models
+import logging
+from collections import defaultdict
+from datetime import timedelta
+from django.db import connection, models, transaction
+from django.db.models import Case, F, FloatField, Q, Value, When
+from django.db.models.functions import Concat, Now, Substr
 from django.conf import settings
 from django.core.validators import MinValueValidator
+from django.utils import timezone
 from django.utils.text import slugify
 from django.core.exceptions import ValidationError
+from localmart.uploads import MAX_IMAGE_SIZE
+from .blobs import blob_name, hash_file
+from .geo import encode_geohash
+from .ranking import popularity_score
+
+logger = logging.getLogger(__name__)
 
 class Category(models.Model):
     name = models.CharField(max_length=100)
@@ -13,9 +25,13 @@ class Category(models.Model):
         default='folder-outline'
     )
     parent = models.ForeignKey('self', null=True, blank=True, on_delete=models.CASCADE, related_name='children')
+    # Materialized path of ancestor ids, e.g. "1/7/12/"
+    path = models.CharField(max_length=255, blank=True, default='', db_index=True, editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
     order = models.IntegerField(default=0)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         verbose_name_plural = 'categories'
@@ -27,14 +43,78 @@ class Category(models.Model):
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
+        parent_path = ''
+        if self.parent_id:
+            parent_path = Category.objects.values_list('path', flat=True).get(pk=self.parent_id)
+        if self.path and parent_path.startswith(self.path):
+            raise ValidationError('A category cannot be moved below its own descendant')
         super().save(*args, **kwargs)
 
+        old_path = self.path
+        path = f'{parent_path}{self.pk}/'
+        if path == old_path:
+            return
+        depth = path.count('/') - 1
+        Category.objects.filter(pk=self.pk).update(path=path, depth=depth)
+        if old_path:
+            # Moved: rewrite the subtree's paths in a single statement
+            Category.objects.filter(Category.subtree_filter(old_path)).exclude(pk=self.pk).update(
+                path=Concat(Value(path), Substr('path', len(old_path) + 1)),
+                depth=F('depth') + (depth - self.depth)
+            )
+        self.path = path
+        self.depth = depth
+
+    @staticmethod
+    def subtree_filter(path, field='path'):
+        """Q for a path and everything below it, as an index scan"""
+        # A prefix match is right under any collation; on Postgres the
+        # varchar_pattern_ops index Django adds for db_index CharFields serves it
+        condition = Q(**{f'{field}__startswith': path})
+        if connection.vendor == 'sqlite':
+            # SQLite can't use an index for LIKE ... ESCAPE, but compares text
+            # bytewise, where '0' follows '/' and so bounds every "<path>..."
+            condition &= Q(**{f'{field}__gte': path, f'{field}__lt': path[:-1] + '0'})
+        return condition
+
+    def descendants_filter(self, field='category__path'):
+        return Category.subtree_filter(self.path, field)
+
     @property
     def full_name(self):
         if self.parent:
             return f"{self.parent.name} > {self.name}"
         return self.name
 
+class ProductQuerySet(models.QuerySet):
+    def with_related(self):
+        """Load everything ProductSerializer renders in a fixed number of queries"""
+        return self.select_related('seller', 'category').prefetch_related('images')
+
+    def live(self):
+        """Active listings whose expiry_date, if any, hasn't passed yet"""
+        return self.filter(Q(expiry_date__isnull=True) | Q(expiry_date__gt=Now()), is_active=True)
+
+    def refresh_popularity(self, batch_size=500):
+        """Recompute popularity_score from lifetime engagement; returns how many"""
+        rows = self.order_by().values_list(
+            'id', 'created_at', 'is_urgent',
+            'analytics__total_views', 'analytics__wishlist_adds', 'analytics__message_count',
+        )
+        scores = {
+            product_id: popularity_score(created_at, is_urgent, views or 0, wishlist_adds or 0, messages or 0)
+            for product_id, created_at, is_urgent, views, wishlist_adds, messages in rows
+        }
+        product_ids = list(scores)
+        # update() leaves updated_at alone, so rescoring doesn't move ETags
+        for start in range(0, len(product_ids), batch_size):
+            batch = product_ids[start:start + batch_size]
+            Product.objects.filter(pk__in=batch).update(popularity_score=Case(
+                *[When(pk=product_id, then=Value(scores[product_id])) for product_id in batch],
+                output_field=FloatField(),
+            ))
+        return len(product_ids)
+
 class Product(models.Model):
     CONDITION_CHOICES = [
         ('new', 'New'),
@@ -56,21 +136,66 @@ class Product(models.Model):
     location = models.CharField(max_length=255)
     latitude = models.FloatField(null=True, blank=True)
     longitude = models.FloatField(null=True, blank=True)
+    geohash = models.CharField(max_length=12, blank=True, default='', db_index=True, editable=False)
     views_count = models.IntegerField(default=0)
+    # Precomputed rank for the "popular" sort; see products.ranking
+    popularity_score = models.FloatField(default=0, editable=False)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ProductQuerySet.as_manager()
+
     class Meta:
         db_table = 'products'
         ordering = ['-created_at']
+        # Partial on is_active: SQLite renders the filter as a bare boolean
+        # column, which only a partial index (not a leading column) can use
+        indexes = [
+            # Expiry sweeps
+            models.Index(
+                fields=['expiry_date'], condition=Q(is_active=True), name='products_live_expiry_idx'
+            ),
+            # The default feed, newest first; scanned backwards for the id tiebreak
+            models.Index(
+                fields=['created_at'], condition=Q(is_active=True), name='products_live_created_idx'
+            ),
+            # Category and price filters, and the facet counts over them
+            models.Index(
+                fields=['category', 'price'], condition=Q(is_active=True), name='products_live_cat_price_idx'
+            ),
+            # The popular feed, best first
+            models.Index(
+                fields=['popularity_score'], condition=Q(is_active=True), name='products_live_popular_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        self.update_geohash()
+        if self._state.adding:
+            self.update_popularity_score()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'geohash'}
+        super().save(*args, **kwargs)
+
+    def update_geohash(self):
+        # Also called directly by bulk inserts, which skip save()
+        if self.latitude is not None and self.longitude is not None:
+            self.geohash = encode_geohash(self.latitude, self.longitude)
+        else:
+            self.geohash = ''
+
+    def update_popularity_score(self):
+        """Score of a listing with no engagement yet; later rescored by the rollups"""
+        self.popularity_score = popularity_score(self.created_at, self.is_urgent)
+
 def validate_image(image):
     # Check file size
-    if image.size > 5 * 1024 * 1024:  # 5MB
+    if image.size > MAX_IMAGE_SIZE:
         raise ValidationError('Image size cannot exceed 5MB')
     
     # Check file type
@@ -78,7 +203,72 @@ def validate_image(image):
     if image.content_type not in allowed_types:
         raise ValidationError('Only JPEG and PNG images are allowed')
 
+# Orphaned blobs are kept this long before collection, so an upload that
+# just matched one can still reference it
+BLOB_GC_GRACE = timedelta(hours=1)
+
+class ImageBlobQuerySet(models.QuerySet):
+    def add_references(self, counts):
+        """Bump ref_count by {blob_id: count}, one UPDATE per distinct count"""
+        by_increment = defaultdict(list)
+        for blob_id, count in counts.items():
+            by_increment[count].append(blob_id)
+        for count, blob_ids in by_increment.items():
+            self.filter(pk__in=blob_ids).update(
+                ref_count=F('ref_count') + count, updated_at=timezone.now()
+            )
+
+    def release(self, blob_id):
+        self.filter(pk=blob_id).update(ref_count=F('ref_count') - 1, updated_at=timezone.now())
+
+    def orphaned(self, grace=BLOB_GC_GRACE):
+        return self.filter(ref_count__lte=0, updated_at__lt=timezone.now() - grace)
+
+    def collect_garbage(self, grace=BLOB_GC_GRACE):
+        """Delete orphaned blobs and their stored files; returns how many"""
+        storage = ProductImage._meta.get_field('image').storage
+        deleted = 0
+        for blob in self.orphaned(grace):
+            # The conditional DELETE re-checks the count in case an upload just referenced it
+            if not self.orphaned(grace).filter(pk=blob.pk).delete()[0]:
+                continue
+            deleted += 1
+            names = [blob.name] + [
+                variant[format] for variant in blob.variants.values() for format in ('jpeg', 'webp')
+            ]
+            for name in names:
+                try:
+                    storage.delete(name)
+                except Exception as e:
+                    logger.error(f"Error deleting image blob file {name}: {str(e)}", exc_info=True)
+        return deleted
+
+class ImageBlob(models.Model):
+    """Image bytes stored once under their sha256, shared by every ProductImage using them"""
+    sha256 = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255)
+    size = models.BigIntegerField(default=0)
+    ref_count = models.IntegerField(default=0)
+    # Variants generated for these bytes, reused by every image of the blob
+    variants = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ImageBlobQuerySet.as_manager()
+
+    class Meta:
+        db_table = 'image_blobs'
+
+    def __str__(self):
+        return self.sha256
+
 class ProductImage(models.Model):
+    VARIANT_STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    ]
+
     product = models.ForeignKey(
         Product, 
         related_name='images', 
@@ -89,11 +279,59 @@ class ProductImage(models.Model):
         validators=[validate_image]
     )
     is_primary = models.BooleanField(default=False)
+    blob = models.ForeignKey(
+        ImageBlob, related_name='images', on_delete=models.SET_NULL, null=True, editable=False
+    )
+    # Resized, EXIF-stripped copies: {size: {'jpeg': name, 'webp': name, 'width', 'height'}}
+    variants = models.JSONField(default=dict, blank=True, editable=False)
+    variant_status = models.CharField(
+        max_length=10, choices=VARIANT_STATUS_CHOICES, default='pending', db_index=True
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         ordering = ['-is_primary', '-created_at']
 
+    def save(self, *args, **kwargs):
+        if self.image and not self.image._committed:
+            # The row and the reference it holds commit together
+            with transaction.atomic():
+                self.attach_blob()
+                super().save(*args, **kwargs)
+            return
+        super().save(*args, **kwargs)
+
+    def attach_blob(self):
+        """
+        Store a new upload under its content address. Bytes that are
+        already stored are referenced instead of written again. The blob row
+        stays locked until its reference is counted, so garbage collection
+        can't delete it in between.
+        """
+        file = self.image.file
+        digest = hash_file(file)
+        with transaction.atomic():
+            blob = ImageBlob.objects.select_for_update().filter(sha256=digest).first()
+            if blob is None:
+                storage = self.image.storage
+                name = storage.save(blob_name(digest, file), file)
+                blob, created = ImageBlob.objects.get_or_create(
+                    sha256=digest, defaults={'name': name, 'size': file.size}
+                )
+                if not created:
+                    # Lost a race with an identical upload; keep the winner's copy
+                    blob = ImageBlob.objects.select_for_update().get(pk=blob.pk)
+                    if blob.name != name:
+                        storage.delete(name)
+
+            previous_blob_id = self.blob_id
+            self.image.name = blob.name
+            self.image._committed = True
+            self.blob = blob
+            ImageBlob.objects.add_references({blob.pk: 1})
+            if previous_blob_id and previous_blob_id != blob.pk:
+                ImageBlob.objects.release(previous_blob_id)
+
 class Review(models.Model):
     product = models.ForeignKey(Product, related_name='reviews', on_delete=models.CASCADE)
     reviewer = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
@@ -132,9 +370,74 @@ class ProductAnalytics(models.Model):
     product = models.OneToOneField(Product, on_delete=models.CASCADE, related_name='analytics')
     total_views = models.IntegerField(default=0)
     unique_views = models.IntegerField(default=0)
+    # HyperLogLog registers behind unique_views
+    viewer_sketch = models.BinaryField(default=b'', editable=False)
     wishlist_adds = models.IntegerField(default=0)
     message_count = models.IntegerField(default=0)
     last_updated = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'product_analytics'
+
+class ProductStatBucket(models.Model):
+    """Per-product event counts rolled up into hourly and daily buckets"""
+    GRANULARITY_CHOICES = [
+        ('hour', 'Hour'),
+        ('day', 'Day'),
+    ]
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stat_buckets')
+    granularity = models.CharField(max_length=4, choices=GRANULARITY_CHOICES)
+    bucket_start = models.DateTimeField()
+    views = models.IntegerField(default=0)
+    wishlist_adds = models.IntegerField(default=0)
+    messages = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'product_stat_buckets'
+        ordering = ['bucket_start']
+        # Also the index behind the analytics range read
+        unique_together = ['product', 'granularity', 'bucket_start']
+
+class RollupWatermark(models.Model):
+    """Highest event id already rolled up, per event source"""
+    source = models.CharField(max_length=20, unique=True)
+    last_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'rollup_watermarks'
+
+class ImportJob(models.Model):
+    """A bulk listing import, processed in chunks by a background worker"""
+    FORMAT_CHOICES = [
+        ('csv', 'CSV'),
+        ('ndjson', 'NDJSON'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    seller = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='import_jobs')
+    file = models.FileField(upload_to='imports/')
+    file_format = models.CharField(max_length=10, choices=FORMAT_CHOICES)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending', db_index=True)
+    # Rows consumed so far; a resumed job skips this many
+    processed_rows = models.IntegerField(default=0)
+    created_count = models.IntegerField(default=0)
+    error_count = models.IntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)
+    failure = models.TextField(blank=True)
+    # Set when a worker claims the job and refreshed with every chunk; a
+    # running job whose claim has gone stale lost its worker
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'import_jobs'
+        ordering = ['-created_at']
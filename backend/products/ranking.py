@@ -0,0 +1,35 @@
+import math
+from datetime import datetime, timezone as dt_timezone
+from django.utils import timezone
+
+# How much one event of each kind counts towards engagement
+ENGAGEMENT_WEIGHTS = {
+    'views': 1,
+    'wishlist_adds': 10,
+    'messages': 20,
+}
+# Seconds of listing age that a tenfold increase in engagement makes up for
+RECENCY_SCALE = 24 * 60 * 60
+# Urgent listings rank as if they had ~3x the engagement
+URGENT_BOOST = 0.5
+SCORE_EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def popularity_score(created_at=None, is_urgent=False, views=0, wishlist_adds=0, messages=0):
+    """
+    "Hot" ranking score of a listing.
+
+    Age is measured from a fixed epoch rather than from now, so newer
+    listings simply start higher and scores never need decaying: a listing
+    only has to be rescored when its engagement or urgency changes.
+    """
+    engagement = (
+        views * ENGAGEMENT_WEIGHTS['views']
+        + wishlist_adds * ENGAGEMENT_WEIGHTS['wishlist_adds']
+        + messages * ENGAGEMENT_WEIGHTS['messages']
+    )
+    age = ((created_at or timezone.now()) - SCORE_EPOCH).total_seconds()
+    score = math.log10(1 + engagement) + age / RECENCY_SCALE
+    if is_urgent:
+        score += URGENT_BOOST
+    return round(score, 6)
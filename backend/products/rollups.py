@@ -0,0 +1,194 @@
+from collections import defaultdict
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Max
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+from chat.models import Message
+from .cache import bump_generation
+from .models import (
+    Product, ProductAnalytics, ProductStatBucket, ProductView, RollupWatermark, Wishlist
+)
+
+ROLLUP_BATCH_SIZE = 10000
+DEFAULT_SETTLE_DELAY = 60  # seconds
+GRANULARITY_STEPS = {
+    'hour': timedelta(hours=1),
+    'day': timedelta(days=1),
+}
+MAX_PERIODS = {
+    'hour': 168,
+    'day': 365,
+}
+BUCKET_FIELDS = ['views', 'wishlist_adds', 'messages']
+
+# source -> (events queryset, product column, bucket field, lifetime ProductAnalytics field)
+# Lifetime views are already kept by the view buffer.
+SOURCES = {
+    'views': (ProductView.objects.all, 'product_id', 'views', None),
+    'wishlist': (Wishlist.objects.all, 'product_id', 'wishlist_adds', 'wishlist_adds'),
+    'messages': (Message.objects.all, 'room__product_id', 'messages', 'message_count'),
+}
+
+
+def bucket_start(value, granularity):
+    value = timezone.localtime(value).replace(minute=0, second=0, microsecond=0)
+    if granularity == 'day':
+        value = value.replace(hour=0)
+    return value
+
+
+def add_to_buckets(field, counts):
+    """Add {(product_id, granularity, bucket_start): count} onto the bucket rows"""
+    product_ids = {product_id for product_id, _, _ in counts}
+    starts = [start for _, _, start in counts]
+    existing = {
+        (bucket.product_id, bucket.granularity, bucket.bucket_start): bucket
+        for bucket in ProductStatBucket.objects.filter(
+            product_id__in=product_ids,
+            bucket_start__gte=min(starts),
+            bucket_start__lte=max(starts),
+        )
+    }
+    updated, created = [], []
+    for key, count in counts.items():
+        bucket = existing.get(key)
+        if bucket is None:
+            product_id, granularity, start = key
+            created.append(ProductStatBucket(
+                product_id=product_id, granularity=granularity, bucket_start=start, **{field: count}
+            ))
+        else:
+            setattr(bucket, field, getattr(bucket, field) + count)
+            updated.append(bucket)
+    ProductStatBucket.objects.bulk_update(updated, [field], batch_size=500)
+    ProductStatBucket.objects.bulk_create(created, batch_size=500)
+
+
+def add_to_lifetime_totals(field, totals):
+    ProductAnalytics.objects.bulk_create(
+        [ProductAnalytics(product_id=product_id) for product_id in totals],
+        ignore_conflicts=True
+    )
+    by_increment = defaultdict(list)
+    for product_id, count in totals.items():
+        by_increment[count].append(product_id)
+    for count, product_ids in by_increment.items():
+        ProductAnalytics.objects.filter(product_id__in=product_ids).update(
+            **{field: F(field) + count}
+        )
+
+
+def roll_up_source(source, batch_size=ROLLUP_BATCH_SIZE):
+    """
+    Roll up one batch of events newer than the source's watermark.
+
+    Events are grouped by product and hour in the database; daily buckets
+    are summed from the hourly rows, and the products involved get their
+    popularity_score refreshed. The watermark is an event id, and a
+    transaction can commit a lower id after a higher one is visible, so the
+    batch stops at the first event younger than PRODUCT_ROLLUP_SETTLE_DELAY.
+    Only transactions open longer than that can still be missed.
+    Returns the number of events rolled up.
+    """
+    get_events, product_field, bucket_field, lifetime_field = SOURCES[source]
+    settle_delay = getattr(settings, 'PRODUCT_ROLLUP_SETTLE_DELAY', DEFAULT_SETTLE_DELAY)
+    with transaction.atomic():
+        RollupWatermark.objects.get_or_create(source=source)
+        # Serializes concurrent rollups of the same source
+        watermark = RollupWatermark.objects.select_for_update().get(source=source)
+
+        events = get_events().filter(id__gt=watermark.last_id).order_by()
+        cutoff = timezone.now() - timedelta(seconds=settle_delay)
+        unsettled = events.filter(created_at__gt=cutoff).order_by('id').values_list('id', flat=True)[:1]
+        if unsettled:
+            events = events.filter(id__lt=unsettled[0])
+        batch = list(events.order_by('id').values_list('id', flat=True)[batch_size - 1:batch_size])
+        if batch:
+            events = events.filter(id__lte=batch[0])
+        rows = list(
+            events.annotate(hour=TruncHour('created_at'))
+            .values(product_field, 'hour')
+            .annotate(count=Count('id'), last_id=Max('id'))
+        )
+        if not rows:
+            return 0
+
+        counts = defaultdict(int)
+        totals = defaultdict(int)
+        for row in rows:
+            product_id = row[product_field]
+            for granularity in GRANULARITY_STEPS:
+                counts[(product_id, granularity, bucket_start(row['hour'], granularity))] += row['count']
+            totals[product_id] += row['count']
+
+        add_to_buckets(bucket_field, counts)
+        if lifetime_field:
+            add_to_lifetime_totals(lifetime_field, totals)
+        # Only listings with new engagement need rescoring
+        Product.objects.filter(pk__in=list(totals)).refresh_popularity()
+
+        watermark.last_id = max(row['last_id'] for row in rows)
+        watermark.save()
+    # Cached "popular" feeds are stale now
+    bump_generation()
+    return sum(totals.values())
+
+
+def roll_up(batch_size=ROLLUP_BATCH_SIZE):
+    """Roll up every source until it is caught up; returns events per source"""
+    rolled_up = {}
+    for source in SOURCES:
+        rolled_up[source] = 0
+        while True:
+            count = roll_up_source(source, batch_size)
+            rolled_up[source] += count
+            if count < batch_size:
+                break
+    return rolled_up
+
+
+def get_time_series(product, granularity='day', periods=30, now=None):
+    """
+    Bucketed counts for the last ``periods`` buckets plus totals for the
+    window before it, read with one range scan of the bucket index.
+    """
+    step = GRANULARITY_STEPS[granularity]
+    last_start = bucket_start(now or timezone.now(), granularity)
+    first_start = last_start - step * (periods - 1)
+    previous_start = first_start - step * periods
+
+    buckets = {
+        bucket['bucket_start']: bucket
+        for bucket in ProductStatBucket.objects.filter(
+            product=product,
+            granularity=granularity,
+            bucket_start__gte=previous_start,
+            bucket_start__lte=last_start,
+        ).values('bucket_start', *BUCKET_FIELDS)
+    }
+
+    empty = dict.fromkeys(BUCKET_FIELDS, 0)
+    series = []
+    totals = dict(empty)
+    previous = dict(empty)
+    start = previous_start
+    while start <= last_start:
+        bucket = buckets.get(start, empty)
+        if start < first_start:
+            target = previous
+        else:
+            target = totals
+            series.append({'start': start, **{field: bucket[field] for field in BUCKET_FIELDS}})
+        for field in BUCKET_FIELDS:
+            target[field] += bucket[field]
+        start += step
+
+    return {
+        'granularity': granularity,
+        'series': series,
+        'totals': totals,
+        'previous': previous,
+        'deltas': {field: totals[field] - previous[field] for field in BUCKET_FIELDS},
+    }
@@ -0,0 +1,208 @@
+import re
+from django.conf import settings
+from django.db import connection
+from django.db.models import FloatField, Q
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+# Matches against the title count this many times more than the description
+TITLE_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(query):
+    return TOKEN_RE.findall(query or '')
+
+
+class BaseSearchBackend:
+    """
+    Keeps the product search index in sync and runs ranked searches.
+
+    `search()` returns the queryset narrowed to matching products and
+    annotated with `search_rank`, where a higher rank is a better match.
+    """
+
+    def install(self, schema_editor):
+        pass
+
+    def uninstall(self, schema_editor):
+        pass
+
+    def index_products(self, products):
+        pass
+
+    def remove_products(self, product_ids):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def index_product(self, product):
+        self.index_products([product])
+
+    def remove_product(self, product_id):
+        self.remove_products([product_id])
+
+    def search(self, queryset, query):
+        raise NotImplementedError
+
+
+class SQLiteSearchBackend(BaseSearchBackend):
+    """FTS5 inverted index ranked with bm25()"""
+
+    table = 'product_search'
+
+    def install(self, schema_editor):
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} "
+            f"USING fts5(title, description, tokenize='unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(
+            f"INSERT INTO {self.table}(rowid, title, description) "
+            f"SELECT id, title, description FROM products"
+        )
+
+    def uninstall(self, schema_editor):
+        schema_editor.execute(f"DROP TABLE IF EXISTS {self.table}")
+
+    def index_products(self, products):
+        rows = [(p.pk, p.title, p.description) for p in products]
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"DELETE FROM {self.table} WHERE rowid = %s",
+                [(row[0],) for row in rows]
+            )
+            cursor.executemany(
+                f"INSERT INTO {self.table}(rowid, title, description) VALUES (%s, %s, %s)",
+                rows
+            )
+
+    def remove_products(self, product_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"DELETE FROM {self.table} WHERE rowid = %s",
+                [(pk,) for pk in product_ids]
+            )
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table}")
+            cursor.execute(
+                f"INSERT INTO {self.table}(rowid, title, description) "
+                f"SELECT id, title, description FROM products"
+            )
+
+    def build_match(self, query):
+        """Quote every token so user input can't inject FTS5 syntax; the
+        last token is a prefix match so results update while typing."""
+        tokens = tokenize(query)
+        if not tokens:
+            return None
+        terms = [f'"{token}"' for token in tokens]
+        terms[-1] += '*'
+        return ' '.join(terms)
+
+    def search(self, queryset, query):
+        match = self.build_match(query)
+        if match is None:
+            return queryset.none()
+
+        # Joining the FTS table lets SQLite drive the query from the
+        # index, so only matching products are ever read.
+        product_table = queryset.model._meta.db_table
+        return queryset.extra(
+            tables=[self.table],
+            where=[
+                f'{self.table}.rowid = {product_table}.id',
+                f'{self.table} MATCH %s',
+            ],
+            params=[match],
+        ).annotate(
+            search_rank=RawSQL(
+                f'-bm25({self.table}, %s, %s)',
+                (TITLE_WEIGHT, DESCRIPTION_WEIGHT),
+                output_field=FloatField()
+            )
+        )
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """tsvector search over a GIN expression index, ranked with ts_rank()"""
+
+    config = 'english'
+    index_name = 'products_search_gin'
+
+    def get_vector(self):
+        from django.contrib.postgres.search import SearchVector
+        return (
+            SearchVector('title', weight='A', config=self.config) +
+            SearchVector('description', weight='B', config=self.config)
+        )
+
+    def get_index(self):
+        from django.contrib.postgres.indexes import GinIndex
+        return GinIndex(self.get_vector(), name=self.index_name)
+
+    def install(self, schema_editor):
+        from .models import Product
+        schema_editor.add_index(Product, self.get_index())
+
+    def uninstall(self, schema_editor):
+        from .models import Product
+        schema_editor.remove_index(Product, self.get_index())
+
+    def search(self, queryset, query):
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+
+        tokens = tokenize(query)
+        if not tokens:
+            return queryset.none()
+
+        vector = self.get_vector()
+        search_query = SearchQuery(
+            ' & '.join(tokens) + ':*',
+            search_type='raw',
+            config=self.config
+        )
+        # Weights are D, C, B, A; title (A) is boosted over description (B)
+        weights = [0.1, 0.2, DESCRIPTION_WEIGHT / TITLE_WEIGHT, 1.0]
+        return queryset.annotate(
+            search_vector=vector
+        ).filter(
+            search_vector=search_query
+        ).annotate(
+            search_rank=SearchRank(vector, search_query, weights=weights)
+        )
+
+
+class LikeSearchBackend(BaseSearchBackend):
+    """Unindexed fallback for databases without a full-text backend"""
+
+    def search(self, queryset, query):
+        condition = Q(title__icontains=query) | Q(description__icontains=query)
+        return queryset.filter(condition).annotate(
+            search_rank=RawSQL('0', (), output_field=FloatField())
+        )
+
+
+VENDOR_BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_search_backend(using=None):
+    vendor = (using or connection).vendor
+    backend_path = getattr(settings, 'PRODUCT_SEARCH_BACKEND', None)
+    if backend_path:
+        return import_string(backend_path)()
+    return VENDOR_BACKENDS.get(vendor, LikeSearchBackend)()
+
+
+def search_products(queryset, query):
+    """Filter to products matching `query`, annotated with `search_rank`"""
+    return get_search_backend().search(queryset, query)
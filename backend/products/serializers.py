@@ -1,5 +1,79 @@
 from rest_framework import serializers
-from .models import Product, ProductImage, Category, Wishlist
+from django.db.models import Prefetch
+from django.db.models.functions import Substr
+from django.utils.text import Truncator
+from .models import Product, ProductImage, Category, Wishlist, ImportJob
+
+DESCRIPTION_PREVIEW_LENGTH = 120
+# Export column -> queryset lookup for ?output=csv/ndjson listing exports
+PRODUCT_EXPORT_COLUMNS = {
+    'id': 'id',
+    'title': 'title',
+    'description': 'description',
+    'price': 'price',
+    'condition': 'condition',
+    'quantity': 'quantity',
+    'category': 'category__name',
+    'location': 'location',
+    'latitude': 'latitude',
+    'longitude': 'longitude',
+    'is_urgent': 'is_urgent',
+    'is_negotiable': 'is_negotiable',
+    'expiry_date': 'expiry_date',
+    'views_count': 'views_count',
+    'created_at': 'created_at',
+}
+
+def parse_field_list(value):
+    return {name.strip() for name in (value or '').split(',') if name.strip()}
+
+class SparseFieldsMixin:
+    """
+    Renders only the fields named in ?fields= minus any in ?exclude= on GET
+    requests, rejecting unknown names, and narrows the SQL column list to match via
+    prepare_queryset(). Meta.field_columns lists the columns read by
+    fields that aren't plain model fields.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or request.method != 'GET':
+            return
+
+        requested = parse_field_list(request.query_params.get('fields'))
+        excluded = parse_field_list(request.query_params.get('exclude'))
+        for param, names in [('fields', requested), ('exclude', excluded)]:
+            unknown = names - set(self.fields)
+            if unknown:
+                raise serializers.ValidationError({param: f"Unknown fields: {', '.join(sorted(unknown))}"})
+        for name in list(self.fields):
+            if (requested and name not in requested) or name in excluded:
+                self.fields.pop(name)
+
+    def get_columns(self):
+        field_columns = getattr(self.Meta, 'field_columns', {})
+        columns = {'id'}
+        for name, field in self.fields.items():
+            if name in field_columns:
+                columns.update(field_columns[name])
+            else:
+                columns.add(field.source.replace('.', '__'))
+        return columns
+
+    def prepare_queryset(self, queryset):
+        columns = self.get_columns()
+        # Keep sort keys loaded so cursors don't trigger deferred loads
+        concrete = {field.name for field in queryset.model._meta.concrete_fields}
+        columns.update(
+            name.lstrip('-') for name in queryset.query.order_by
+            if isinstance(name, str) and name.lstrip('-') in concrete
+        )
+        relations = {column.split('__')[0] for column in columns if '__' in column}
+        queryset = queryset.select_related(None)
+        if relations:
+            queryset = queryset.select_related(*relations)
+        return queryset.only(*columns)
 
 class CategorySerializer(serializers.ModelSerializer):
     children = serializers.SerializerMethodField()
@@ -10,16 +84,34 @@ class CategorySerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'slug', 'icon', 'parent', 'order', 'is_active', 'children']
 
     def get_children(self, obj):
+        # The cached category tree passes every node's active children in
+        children = self.context.get('children')
+        if children is not None:
+            return CategorySerializer(children.get(obj.id, []), many=True, context=self.context).data
         if hasattr(obj, 'children'):
             return CategorySerializer(obj.children.filter(is_active=True), many=True).data
         return []
 
 class ProductImageSerializer(serializers.ModelSerializer):
+    variants = serializers.SerializerMethodField()
+
     class Meta:
         model = ProductImage
-        fields = ['id', 'image', 'is_primary']
+        fields = ['id', 'image', 'is_primary', 'variants']
+
+    def get_variants(self, obj):
+        """URLs of the resized copies; empty until the worker has made them"""
+        storage = obj.image.storage
+        request = self.context.get('request')
+        variants = {}
+        for size, variant in (obj.variants or {}).items():
+            variants[size] = {'width': variant['width'], 'height': variant['height']}
+            for format in ('jpeg', 'webp'):
+                url = storage.url(variant[format])
+                variants[size][format] = request.build_absolute_uri(url) if request else url
+        return variants
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     images = ProductImageSerializer(many=True, read_only=True)
     seller_name = serializers.CharField(source='seller.username', read_only=True)
     category_name = serializers.CharField(source='category.name', read_only=True)
@@ -34,14 +126,82 @@ class ProductSerializer(serializers.ModelSerializer):
             'latitude', 'longitude', 'views_count', 'is_active'
         ]
         read_only_fields = ['seller', 'created_at', 'updated_at', 'views_count']
+        # User has no username column, so seller_name only needs the join
+        field_columns = {'images': [], 'seller_name': ['seller__id']}
+
+    def prepare_queryset(self, queryset):
+        queryset = super().prepare_queryset(queryset).prefetch_related(None)
+        if 'images' in self.fields:
+            queryset = queryset.prefetch_related('images')
+        return queryset
 
     def create(self, validated_data):
         validated_data['seller'] = self.context['request'].user
         return super().create(validated_data) 
 
+class ProductListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """Compact representation for browse grids: the primary image only and
+    a truncated description"""
+    description = serializers.SerializerMethodField()
+    images = serializers.SerializerMethodField()
+    seller_name = serializers.CharField(source='seller.username', read_only=True)
+    category_name = serializers.CharField(source='category.name', read_only=True)
+    distance = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Product
+        fields = [
+            'id', 'title', 'description', 'price', 'condition', 'is_urgent',
+            'is_negotiable', 'location', 'created_at', 'seller', 'seller_name',
+            'category', 'category_name', 'images', 'distance'
+        ]
+        field_columns = {
+            'description': [], 'images': [], 'distance': [], 'seller_name': ['seller__id']
+        }
+
+    def prepare_queryset(self, queryset):
+        queryset = super().prepare_queryset(queryset).prefetch_related(None)
+        if 'description' in self.fields:
+            queryset = queryset.annotate(
+                description_preview=Substr('description', 1, DESCRIPTION_PREVIEW_LENGTH + 1)
+            )
+        if 'images' in self.fields:
+            primary = ProductImage.objects.order_by('-is_primary', '-created_at')[:1]
+            queryset = queryset.prefetch_related(
+                Prefetch('images', queryset=primary, to_attr='primary_images')
+            )
+        return queryset
+
+    def get_description(self, obj):
+        if hasattr(obj, 'description_preview'):
+            text = obj.description_preview
+        else:
+            text = obj.description
+        return Truncator(text).chars(DESCRIPTION_PREVIEW_LENGTH)
+
+    def get_images(self, obj):
+        if hasattr(obj, 'primary_images'):
+            images = obj.primary_images
+        else:
+            images = obj.images.all()[:1]
+        return ProductImageSerializer(images, many=True, context=self.context).data
+
+    def get_distance(self, obj):
+        distance = getattr(obj, 'distance', None)
+        return round(distance, 2) if distance is not None else None
+
 class WishlistSerializer(serializers.ModelSerializer):
     product = ProductSerializer()
 
     class Meta:
         model = Wishlist
-        fields = ['id', 'product', 'created_at']
\ No newline at end of file
+        fields = ['id', 'product', 'created_at']
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ImportJob
+        fields = [
+            'id', 'file_format', 'status', 'processed_rows', 'created_count',
+            'error_count', 'errors', 'failure', 'created_at', 'finished_at'
+        ]
+        read_only_fields = fields
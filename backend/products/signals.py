@@ -0,0 +1,68 @@
+from django.db.models.signals import post_save, post_delete
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils import timezone
+from .models import Category, ImageBlob, Product, ProductImage
+from .search import get_search_backend
+from .category_tree import invalidate_category_tree
+from .cache import bump_generation
+from .image_variants import variant_worker
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    get_search_backend().index_product(instance)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    get_search_backend().remove_product(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+def rescore_product(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    # New listings are scored in save(); edits may toggle is_urgent
+    if created or raw or (update_fields is not None and 'is_urgent' not in update_fields):
+        return
+    Product.objects.filter(pk=instance.pk).refresh_popularity()
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, **kwargs):
+    invalidate_category_tree()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_cached_responses(sender, **kwargs):
+    bump_generation()
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def touch_product(sender, instance, raw=False, **kwargs):
+    # Image changes must move the product's ETag / Last-Modified
+    if raw:
+        return
+    Product.objects.filter(pk=instance.product_id).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=ProductImage)
+def queue_image_variants(sender, instance, created=False, raw=False, **kwargs):
+    if created and not raw:
+        image_id = instance.pk
+        transaction.on_commit(lambda: variant_worker.enqueue(image_id))
+
+
+@receiver(post_delete, sender=ProductImage)
+def release_image_blob(sender, instance, **kwargs):
+    # Blobs left without references are removed by collect_image_blobs
+    if instance.blob_id:
+        ImageBlob.objects.release(instance.blob_id)
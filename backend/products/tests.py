@@ -1,3 +1,958 @@
-from django.test import TestCase
+import json
+import os
+import re
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
+from io import BytesIO, StringIO
+from PIL import Image
+from django.core.cache import cache
+from django.core.management import call_command
+from django.utils import timezone
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError, connection
+from unittest import skipUnless
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from users.models import User
+from .models import (
+    Category, ImageBlob, ImportJob, Product, ProductAnalytics, ProductImage, ProductStatBucket,
+    ProductView, RollupWatermark, Wishlist
+)
+from .blobs import hash_file
+from .category_tree import VERSION_KEY, get_category_tree_version
+from .expiry import expire_listings
+from .geo import MAX_COVER_CELLS, bounding_box, covering_geohashes, encode_geohash
+from .imports import (
+    IMPORT_CLAIM_TIMEOUT, ImportJobLost, claim_import, import_chunk, run_import,
+)
+from .rollups import roll_up
+from .uploads import store_files
+from .view_buffer import view_buffer
 
-# Create your tests here.
+
+def create_products(seller, category, count, images=2):
+    products = []
+    for index in range(count):
+        product = Product.objects.create(
+            seller=seller,
+            category=category,
+            title=f'Phone {index}',
+            description='A used phone in good condition',
+            price=100 + index,
+            condition='good',
+            location='Bangalore',
+        )
+        for image_index in range(images):
+            ProductImage.objects.create(
+                product=product,
+                image=f'product_images/{product.id}-{image_index}.jpg',
+                is_primary=image_index == 0
+            )
+        products.append(product)
+    return products
+
+
+# A plan step reading a whole table; "SCAN x USING INDEX" is an ordered index walk
+FULL_SCAN = re.compile(r'^SCAN (\w+)$')
+
+
+def explain(sql):
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        return [row[-1] for row in cursor.fetchall()]
+
+
+@override_settings(PRODUCT_VIEW_FLUSH_INTERVAL=None, PRODUCT_ROLLUP_SETTLE_DELAY=0)
+class ProductTestCase(TestCase):
+    """A seller, a buyer and a two-level category tree, with caches reset"""
+
+    def setUp(self):
+        cache.clear()
+        view_buffer.clear()
+        self.seller = User.objects.create_user(email='seller@example.com', password='pass1234')
+        self.buyer = User.objects.create_user(email='buyer@example.com', password='pass1234')
+        self.parent = Category.objects.create(name='Electronics')
+        self.category = Category.objects.create(name='Phones', parent=self.parent)
+        self.client = APIClient()
+
+    def authenticate(self, user):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+
+    def grow_products(self, count):
+        missing = count - Product.objects.count()
+        create_products(self.seller, self.category, missing)
+
+
+class QueryBudgetMixin:
+    """
+    Endpoints must load with a fixed number of queries. Each test
+    requests the endpoint with a small and a larger data set and expects
+    the same budget for both.
+    """
+
+    def assertQueryBudget(self, budget, url, grow, params=None):
+        for count in (2, 10):
+            grow(count)
+            with self.assertNumQueries(budget):
+                response = self.client.get(url, params or {})
+            self.assertEqual(response.status_code, 200)
+
+    def assertNoFullScans(self, url, params=None, method='get'):
+        """Run EXPLAIN QUERY PLAN on every SELECT the request makes"""
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(url, params or {})
+        self.assertLess(response.status_code, 300)
+        tables = set(connection.introspection.table_names())
+        for query in context.captured_queries:
+            if not query['sql'].startswith('SELECT'):
+                continue
+            plan = explain(query['sql'])
+            scans = [
+                line for line in plan
+                if FULL_SCAN.match(line) and FULL_SCAN.match(line).group(1) in tables
+            ]
+            self.assertFalse(scans, f"Full scan in {url}:\n{query['sql']}\n" + '\n'.join(plan))
+        return context.captured_queries
+
+
+class QueryBudgetTestCase(QueryBudgetMixin, ProductTestCase):
+    pass
+
+
+class ProductQueryBudgetTests(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        # Read once a minute per process rather than per request
+        get_category_tree_version()
+
+    def test_product_list(self):
+        # products, images
+        self.assertQueryBudget(2, '/api/products/', self.grow_products)
+
+    def test_product_search(self):
+        self.assertQueryBudget(2, '/api/products/', self.grow_products, {'search': 'phone'})
+
+    def test_product_detail(self):
+        product = create_products(self.seller, self.category, 1)[0]
+        # ETag lookup, product, images
+        with self.assertNumQueries(3):
+            response = self.client.get(f'/api/products/{product.id}/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_not_modified(self):
+        product = create_products(self.seller, self.category, 1)[0]
+        etags = {}
+        # The list ETag comes from the cache generation; detail looks up updated_at
+        for url, queries in [('/api/products/', 0), (f'/api/products/{product.id}/', 1)]:
+            etags[url] = self.client.get(url)['ETag']
+            with self.assertNumQueries(queries):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[url])
+            self.assertEqual(response.status_code, 304)
+
+        ProductImage.objects.create(product=product, image='product_images/new.jpg')
+        for url, etag in etags.items():
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+
+    def test_my_listings(self):
+        self.authenticate(self.seller)
+        # user, products, images
+        self.assertQueryBudget(3, '/api/products/my/', self.grow_products)
+
+    def test_category_products(self):
+        self.authenticate(self.buyer)
+        # user, category, products, images
+        self.assertQueryBudget(
+            4, f'/api/categories/{self.parent.id}/products/', self.grow_products
+        )
+
+    def test_category_list(self):
+        self.authenticate(self.buyer)
+
+        def grow(count):
+            while Category.objects.count() < count:
+                Category.objects.create(name=f'Category {Category.objects.count()}', parent=self.parent)
+            cache.clear()
+
+        # user, category version, categories (the tree is then served from memory)
+        self.assertQueryBudget(3, '/api/categories/', grow)
+        with self.assertNumQueries(1):
+            self.client.get('/api/categories/')
+
+    def test_seller_products(self):
+        self.authenticate(self.buyer)
+        # user, seller, products, images
+        self.assertQueryBudget(4, f'/api/users/{self.seller.id}/products/', self.grow_products)
+
+    def test_wishlist(self):
+        self.authenticate(self.buyer)
+
+        def grow(count):
+            self.grow_products(count)
+            for product in Product.objects.exclude(wishlist__user=self.buyer):
+                Wishlist.objects.create(user=self.buyer, product=product)
+
+        # user, wishlist with products, images
+        self.assertQueryBudget(3, '/api/wishlist/', grow)
+
+
+class ProductCategoryTreeTests(ProductTestCase):
+    def setUp(self):
+        super().setUp()
+        self.authenticate(self.buyer)
+
+    def names(self):
+        response = self.client.get('/api/categories/')
+        self.assertEqual(response.status_code, 200)
+        return {node['name'] for node in response.data}
+
+    def test_tree_follows_category_changes(self):
+        self.assertEqual(self.names(), {'Electronics', 'Phones'})
+        laptops = Category.objects.create(name='Laptops', parent=self.parent)
+        self.assertEqual(self.names(), {'Electronics', 'Phones', 'Laptops'})
+        laptops.delete()
+        self.assertEqual(self.names(), {'Electronics', 'Phones'})
+
+    def test_subtrees_stop_at_the_separator(self):
+        paths = ['5/', '5/7/', '5/78/', '57/', '57/8/', '5/7/9/']
+        categories = [Category.objects.create(name=f'Category {index}') for index in range(len(paths))]
+        for category, path in zip(categories, paths):
+            Category.objects.filter(pk=category.pk).update(path=path)
+
+        def subtree(path):
+            return set(Category.objects.filter(Category.subtree_filter(path)).values_list('path', flat=True))
+
+        self.assertEqual(subtree('5/'), {'5/', '5/7/', '5/78/', '5/7/9/'})
+        self.assertEqual(subtree('5/7/'), {'5/7/', '5/7/9/'})
+        self.assertEqual(subtree('57/'), {'57/', '57/8/'})
+
+        products = create_products(self.seller, categories[1], 2, images=0)
+        Product.objects.filter(pk=products[1].pk).update(category=categories[2])
+        categories[1].refresh_from_db()
+        response = self.client.get(f'/api/categories/{categories[1].id}/products/')
+        self.assertEqual([product['id'] for product in response.data['results']], [products[0].id])
+
+    def test_version_is_derived_from_the_database(self):
+        version = get_category_tree_version()
+        # A write made by another process only expires this process' copy
+        Category.objects.filter(pk=self.category.pk).update(
+            name='Mobiles', updated_at=timezone.now() + timedelta(seconds=1)
+        )
+        self.assertEqual(get_category_tree_version(), version)
+        cache.delete(VERSION_KEY)
+        self.assertNotEqual(get_category_tree_version(), version)
+        self.assertIn('Mobiles', self.names())
+
+
+class ProductResponseCacheTests(ProductTestCase):
+    def get(self, url, params=None):
+        response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_anonymous_reads_are_cached_until_a_write(self):
+        product, = create_products(self.seller, self.category, 1)
+        for url in ['/api/products/', f'/api/products/{product.id}/']:
+            self.assertEqual(self.get(url)['X-Cache'], 'MISS')
+            self.assertEqual(self.get(url)['X-Cache'], 'HIT')
+        # Parameters are part of the key
+        self.assertEqual(self.get('/api/products/', {'sort_by': 'price_asc'})['X-Cache'], 'MISS')
+
+        product.title = 'Tablet'
+        product.save()
+        response = self.get('/api/products/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'][0]['title'], 'Tablet')
+        self.assertEqual(self.get(f'/api/products/{product.id}/').data['title'], 'Tablet')
+
+        ProductImage.objects.filter(product=product).first().delete()
+        response = self.get(f'/api/products/{product.id}/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(len(response.data['images']), 1)
+
+    def test_authenticated_reads_bypass_the_cache(self):
+        create_products(self.seller, self.category, 1)
+        self.get('/api/products/')
+        self.authenticate(self.buyer)
+        self.assertNotIn('X-Cache', self.get('/api/products/'))
+
+        self.buyer.is_staff = True
+        self.buyer.save()
+        stats = self.get('/api/products/cache_stats/').data
+        self.assertEqual((stats['hits'], stats['misses']), (0, 1))
+
+
+class ProductViewBufferTests(ProductTestCase):
+    def test_views_are_flushed_in_batches(self):
+        product = create_products(self.seller, self.category, 1)[0]
+        for index in range(5):
+            self.client.get(f'/api/products/{product.id}/', REMOTE_ADDR=f'10.0.0.{index % 3}')
+        self.authenticate(self.buyer)
+        self.client.get(f'/api/products/{product.id}/')
+
+        # Nothing is written until the buffer is flushed
+        self.assertEqual(ProductView.objects.count(), 0)
+        self.assertEqual(view_buffer.flush(), 6)
+
+        product.refresh_from_db()
+        self.assertEqual(product.views_count, 6)
+        self.assertEqual(ProductView.objects.filter(product=product).count(), 6)
+        analytics = ProductAnalytics.objects.get(product=product)
+        self.assertEqual(analytics.total_views, 6)
+        # Three anonymous addresses and one signed-in buyer
+        self.assertEqual(analytics.unique_views, 4)
+
+        self.client.get(f'/api/products/{product.id}/')
+        view_buffer.flush()
+        analytics.refresh_from_db()
+        self.assertEqual(analytics.total_views, 7)
+        self.assertEqual(analytics.unique_views, 4)
+
+    def test_failed_flush_keeps_views_for_the_next(self):
+        product = create_products(self.seller, self.category, 1)[0]
+        for address in ['10.0.0.1', '10.0.0.2', 'not-an-ip']:
+            self.client.get(f'/api/products/{product.id}/', HTTP_X_FORWARDED_FOR=address)
+
+        with mock.patch.object(ProductView.objects, 'bulk_create', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                view_buffer.flush()
+        self.client.get(f'/api/products/{product.id}/', REMOTE_ADDR='10.0.0.3')
+        self.assertEqual(view_buffer.flush(), 4)
+
+        product.refresh_from_db()
+        self.assertEqual(product.views_count, 4)
+        analytics = ProductAnalytics.objects.get(product=product)
+        self.assertEqual((analytics.total_views, analytics.unique_views), (4, 4))
+        # Spoofed forwarding headers are stored as unknown
+        self.assertEqual(
+            sorted(ProductView.objects.values_list('ip_address', flat=True), key=str),
+            ['10.0.0.1', '10.0.0.2', '10.0.0.3', None]
+        )
+
+
+class ProductAnalyticsRollupTests(ProductTestCase):
+    def test_rollups_are_incremental(self):
+        from chat.models import ChatRoom, Message
+
+        product = create_products(self.seller, self.category, 1)[0]
+        ProductView.objects.bulk_create([ProductView(product=product) for _ in range(3)])
+        Wishlist.objects.create(user=self.buyer, product=product)
+        room = ChatRoom.objects.create(product=product)
+        Message.objects.create(room=room, sender=self.buyer, recipient=self.seller, content='Hi')
+
+        self.assertEqual(roll_up(), {'views': 3, 'wishlist': 1, 'messages': 1})
+        # Only events after the watermark are rolled up again
+        ProductView.objects.create(product=product)
+        self.assertEqual(roll_up(), {'views': 1, 'wishlist': 0, 'messages': 0})
+
+        for granularity in ('hour', 'day'):
+            bucket = ProductStatBucket.objects.get(product=product, granularity=granularity)
+            self.assertEqual(
+                (bucket.views, bucket.wishlist_adds, bucket.messages), (4, 1, 1)
+            )
+        analytics = ProductAnalytics.objects.get(product=product)
+        self.assertEqual((analytics.wishlist_adds, analytics.message_count), (1, 1))
+
+        self.authenticate(self.seller)
+        url = f'/api/products/{product.id}/analytics/'
+        # user, product, analytics, buckets
+        with self.assertNumQueries(4):
+            response = self.client.get(url, {'granularity': 'hour', 'periods': 24})
+        self.assertEqual(len(response.data['series']), 24)
+        self.assertEqual(response.data['series'][-1]['views'], 4)
+        self.assertEqual(response.data['deltas'], {'views': 4, 'wishlist_adds': 1, 'messages': 1})
+        self.assertEqual(self.client.get(url, {'periods': 0}).status_code, 400)
+
+
+    @override_settings(PRODUCT_ROLLUP_SETTLE_DELAY=60)
+    def test_watermark_waits_for_out_of_order_commits(self):
+        product = create_products(self.seller, self.category, 1)[0]
+        first, pending, committed = ProductView.objects.bulk_create(
+            [ProductView(product=product) for _ in range(3)]
+        )
+        # `pending` stands for a row whose transaction is still open
+        settled = timezone.now() - timedelta(minutes=2)
+        ProductView.objects.filter(pk__in=[first.pk, committed.pk]).update(created_at=settled)
+
+        self.assertEqual(roll_up()['views'], 1)
+        self.assertEqual(RollupWatermark.objects.get(source='views').last_id, first.pk)
+
+        ProductView.objects.filter(pk=pending.pk).update(created_at=settled)
+        self.assertEqual(roll_up()['views'], 2)
+        buckets = ProductStatBucket.objects.filter(product=product, granularity='hour')
+        self.assertEqual(sum(buckets.values_list('views', flat=True)), 3)
+
+
+class ProductSortTests(ProductTestCase):
+    def ids(self, params):
+        response = self.client.get('/api/products/', params)
+        self.assertEqual(response.status_code, 200)
+        return [product['id'] for product in response.data['results']]
+
+    def test_only_known_sort_modes_are_accepted(self):
+        oldest, cheapest, newest = create_products(self.seller, self.category, 3)
+        Product.objects.filter(pk=cheapest.pk).update(price=1)
+        self.assertEqual(self.ids({'sort_by': 'newest'}), [newest.id, cheapest.id, oldest.id])
+        self.assertEqual(self.ids({'sort_by': 'price_asc'})[0], cheapest.id)
+        self.assertEqual(self.ids({'sort_by': 'price_desc'})[-1], cheapest.id)
+
+        for params in [{'sort_by': 'seller__password'}, {'sort_by': 'relevance'}, {'sort_by': 'distance'}]:
+            self.assertEqual(self.client.get('/api/products/', params).status_code, 400)
+
+    def test_popular_feed_is_rescored_incrementally(self):
+        from chat.models import ChatRoom, Message
+
+        oldest, middle, newest = create_products(self.seller, self.category, 3)
+        # Without engagement the popular feed is newest first
+        self.assertEqual(self.ids({'sort_by': 'popular'}), [newest.id, middle.id, oldest.id])
+
+        scores = dict(Product.objects.values_list('id', 'popularity_score'))
+        Wishlist.objects.create(user=self.buyer, product=oldest)
+        room = ChatRoom.objects.create(product=oldest)
+        Message.objects.create(room=room, sender=self.buyer, recipient=self.seller, content='Hi')
+        roll_up()
+        self.assertEqual(self.ids({'sort_by': 'popular'}), [oldest.id, newest.id, middle.id])
+        # Listings without new engagement keep their score
+        middle.refresh_from_db()
+        self.assertEqual(middle.popularity_score, scores[middle.id])
+
+        middle.is_urgent = True
+        middle.save()
+        self.assertEqual(self.ids({'sort_by': 'popular'}), [oldest.id, middle.id, newest.id])
+
+
+class ProductSearchTests(ProductTestCase):
+    def search(self, query, **params):
+        response = self.client.get('/api/products/', {'search': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return [product['id'] for product in response.data['results']]
+
+    def test_title_matches_rank_above_description_matches(self):
+        in_description, in_title, unrelated = create_products(self.seller, self.category, 3, images=0)
+        Product.objects.filter(pk=in_description.pk).update(
+            title='Charger', description='Fits any samsung phone'
+        )
+        in_title.title = 'Samsung Galaxy'
+        in_title.save()
+        unrelated.title = 'Desk'
+        unrelated.description = 'Solid oak'
+        unrelated.save()
+        # update() bypasses the signal, so only the saved title is indexed yet
+        self.assertEqual(self.search('samsung'), [in_title.id])
+
+        in_description.refresh_from_db()
+        in_description.save()
+        self.assertEqual(self.search('samsung'), [in_title.id, in_description.id])
+        # The last token is a prefix match
+        self.assertEqual(self.search('galax'), [in_title.id])
+
+    def test_index_follows_edits_and_deletes(self):
+        product, = create_products(self.seller, self.category, 1, images=0)
+        self.assertEqual(self.search('phone'), [product.id])
+
+        product.title = 'Bicycle'
+        product.description = 'Two wheels'
+        product.save()
+        self.assertEqual(self.search('phone'), [])
+        self.assertEqual(self.search('bicycle'), [product.id])
+
+        product.delete()
+        self.assertEqual(self.search('bicycle'), [])
+
+    def test_query_syntax_is_not_interpreted(self):
+        product, = create_products(self.seller, self.category, 1, images=0)
+        for query in ['phone"', 'used:phone', '(phone', '*phone*', '^phone', 'phone -used']:
+            self.assertEqual(self.search(query), [product.id], query)
+        self.assertEqual(self.search('!!!'), [])
+
+
+class ProductGeoTests(ProductTestCase):
+    def place(self, product, latitude, longitude):
+        product.latitude = latitude
+        product.longitude = longitude
+        product.save()
+
+    def nearby(self, near, radius_km):
+        response = self.client.get('/api/products/', {'near': near, 'radius_km': radius_km})
+        self.assertEqual(response.status_code, 200)
+        return {product['id']: product['distance'] for product in response.data['results']}
+
+    def test_geohash_encoding(self):
+        self.assertEqual(encode_geohash(57.64911, 10.40744), 'u4pruydqq')
+        self.assertEqual(encode_geohash(-25.382708, -49.265506, 6), '6gkzwg')
+
+    def test_cover_contains_every_point_in_the_radius(self):
+        for latitude, longitude, radius_km in [(12.97, 77.59, 5), (60.0, 10.0, 40), (-33.9, 151.2, 1)]:
+            prefixes = covering_geohashes(latitude, longitude, radius_km)
+            self.assertLessEqual(len(prefixes), MAX_COVER_CELLS)
+            south, north, west, east = bounding_box(latitude, longitude, radius_km)
+            for point_lat in (south, latitude, north):
+                for point_lng in (west, longitude, east):
+                    geohash = encode_geohash(point_lat, point_lng)
+                    self.assertTrue(
+                        any(geohash.startswith(prefix) for prefix in prefixes),
+                        (latitude, longitude, radius_km, point_lat, point_lng)
+                    )
+        # Too large for prefix ranges, or reaching a pole
+        self.assertIsNone(covering_geohashes(0, 0, 12000))
+        self.assertIsNone(covering_geohashes(89.9, 0, 50))
+
+    def test_radius_across_the_antimeridian(self):
+        south, north, west, east = bounding_box(0, 179.9, 50)
+        self.assertGreater(west, east)
+        self.assertLess(east, -179)
+
+        east_side, west_side, far = create_products(self.seller, self.category, 3, images=0)
+        self.place(east_side, 0, 179.95)
+        self.place(west_side, 0.1, -179.9)
+        self.place(far, 0, 178)
+        distances = self.nearby('0,179.9', 50)
+        self.assertEqual(set(distances), {east_side.id, west_side.id})
+        self.assertAlmostEqual(distances[west_side.id], 24.87, delta=0.1)
+
+    def test_distance_filter_and_sort(self):
+        bangalore, chennai, mysore = create_products(self.seller, self.category, 3, images=0)
+        self.place(bangalore, 12.9716, 77.5946)
+        self.place(chennai, 13.0827, 80.2707)
+        self.place(mysore, 12.2958, 76.6394)
+
+        distances = self.nearby('12.9716,77.5946', 300)
+        self.assertEqual(list(distances), [bangalore.id, mysore.id, chennai.id])
+        self.assertEqual(distances[bangalore.id], 0)
+        self.assertAlmostEqual(distances[mysore.id], 127.9, delta=1)
+        self.assertAlmostEqual(distances[chennai.id], 290.2, delta=1)
+        self.assertEqual(list(self.nearby('12.9716,77.5946', 200)), [bangalore.id, mysore.id])
+
+
+class ProductCursorTests(ProductTestCase):
+    def walk(self, url, params=None, direction='next'):
+        pages = []
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            pages.append([product['id'] for product in response.data['results']])
+            url, params = response.data[direction], None
+        return pages, response.data
+
+    def test_pages_cover_tied_sort_keys_once_in_both_directions(self):
+        products = create_products(self.seller, self.category, 7, images=0)
+        for product, price in zip(products, [300, 100, 200, 100, 300, 100, 200]):
+            Product.objects.filter(pk=product.pk).update(price=price)
+        expected = list(Product.objects.order_by('price', 'id').values_list('id', flat=True))
+
+        pages, last = self.walk('/api/products/', {'sort_by': 'price_asc', 'page_size': 2})
+        self.assertEqual([len(page) for page in pages], [2, 2, 2, 1])
+        self.assertEqual(sum(pages, []), expected)
+        self.assertIsNone(last['next'])
+
+        back, first = self.walk(last['previous'], direction='previous')
+        self.assertEqual(back, pages[-2::-1])
+        self.assertIsNone(first['previous'])
+
+    def test_new_listings_do_not_shift_later_pages(self):
+        create_products(self.seller, self.category, 4, images=0)
+        response = self.client.get('/api/products/', {'page_size': 2})
+        seen = [product['id'] for product in response.data['results']]
+        create_products(self.seller, self.category, 1, images=0)
+
+        response = self.client.get(response.data['next'])
+        seen += [product['id'] for product in response.data['results']]
+        self.assertEqual(seen, sorted(seen, reverse=True))
+        self.assertEqual(len(set(seen)), 4)
+
+    def test_tampered_cursors_are_rejected(self):
+        for cursor in ['garbage', 'eyJwIjpbMV0sInIiOmZhbHNlfQ', 'eyJwIjpbIngiLCJ5Il0sInIiOmZhbHNlfQ']:
+            response = self.client.get('/api/products/', {'cursor': cursor})
+            self.assertEqual(response.status_code, 404, cursor)
+
+
+class ProductSparseFieldsTests(ProductTestCase):
+    def test_fields_and_exclude_narrow_output_and_columns(self):
+        product, = create_products(self.seller, self.category, 1)
+        Product.objects.filter(pk=product.pk).update(description='x' * 500)
+
+        response = self.client.get('/api/products/')
+        self.assertEqual(len(response.data['results'][0]['description']), 120)
+        self.assertEqual(len(response.data['results'][0]['images']), 1)
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/products/', {'fields': 'id,title,price'})
+        self.assertEqual(response.data['results'], [{'id': product.id, 'title': 'Phone 0', 'price': '100.00'}])
+        # No image prefetch, and the description column isn't read
+        sql = '\n'.join(query['sql'] for query in context.captured_queries)
+        self.assertNotIn('productimage', sql)
+        self.assertNotIn('"description"', sql)
+
+        response = self.client.get(f'/api/products/{product.id}/', {'exclude': 'description,images'})
+        self.assertNotIn('description', response.data)
+        self.assertNotIn('images', response.data)
+        self.assertEqual(response.data['title'], 'Phone 0')
+
+    def test_unknown_fields_are_rejected(self):
+        create_products(self.seller, self.category, 1)
+        for params in [{'fields': 'bogus'}, {'fields': 'id,seller__password'}, {'exclude': 'bogus'}]:
+            response = self.client.get('/api/products/', params)
+            self.assertEqual(response.status_code, 400, params)
+        self.assertIn('bogus', str(self.client.get('/api/products/', {'fields': 'bogus'}).data))
+
+
+class ProductFacetTests(ProductTestCase):
+    def test_facet_counts_follow_the_filters(self):
+        cheap, mid, pricey = create_products(self.seller, self.category, 3, images=0)
+        other = Category.objects.create(name='Laptops', parent=self.parent)
+        Product.objects.filter(pk=cheap.pk).update(price=200, is_urgent=True)
+        Product.objects.filter(pk=mid.pk).update(price=700, condition='new')
+        Product.objects.filter(pk=pricey.pk).update(price=60000, category=other)
+
+        facets = self.client.get('/api/products/facets/').data
+        self.assertEqual(facets['total'], 3)
+        self.assertEqual(
+            [(c['name'], c['count']) for c in facets['categories']], [('Phones', 2), ('Laptops', 1)]
+        )
+        conditions = {c['value']: c['count'] for c in facets['conditions']}
+        self.assertEqual((conditions['new'], conditions['good']), (1, 2))
+        self.assertEqual(facets['is_urgent'], {'true': 1, 'false': 2})
+        self.assertEqual([r['count'] for r in facets['price_ranges']], [1, 1, 0, 0, 0, 1])
+
+        facets = self.client.get(
+            '/api/products/facets/', {'category': self.category.id, 'max_price': 500}
+        ).data
+        self.assertEqual(facets['total'], 1)
+        self.assertEqual(facets['is_urgent'], {'true': 1, 'false': 0})
+
+    def test_malformed_filters_are_rejected(self):
+        for params in [
+            {'min_price': 'abc'}, {'max_price': 'NaN'}, {'category': 'abc'},
+            {'near': 'abc'}, {'near': '12.9,77.5', 'radius_km': 5000},
+        ]:
+            for url in ['/api/products/facets/', '/api/products/']:
+                self.assertEqual(self.client.get(url, params).status_code, 400, (url, params))
+
+        self.authenticate(self.buyer)
+        url = f'/api/categories/{self.category.id}/products/'
+        for params in [{'min_price': 'abc'}, {'max_price': 'NaN'}, {'near': 'abc'}]:
+            self.assertEqual(self.client.get(url, params).status_code, 400, params)
+        response = self.client.get(url, {'min_price': '0', 'max_price': '1000000'})
+        self.assertEqual(response.status_code, 200)
+
+
+def create_upload(name='photo.jpg', size=(2000, 1000), exif=None, color='red'):
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, format='JPEG', exif=exif or Image.Exif())
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+class MediaTestCase(ProductTestCase):
+    """Stores uploads in a temporary MEDIA_ROOT"""
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        overrides = self.settings(MEDIA_ROOT=self.media_root, PRODUCT_IMAGE_VARIANTS_ASYNC=False)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+
+class ProductImageVariantTests(MediaTestCase):
+    def test_variants_are_generated_after_commit(self):
+        product = create_products(self.seller, self.category, 1, images=0)[0]
+        exif = Image.Exif()
+        exif[0x010F] = 'Camera maker'
+        upload = create_upload(exif=exif)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            image = ProductImage.objects.create(product=product, image=upload, is_primary=True)
+
+        image.refresh_from_db()
+        self.assertEqual(image.variant_status, 'ready')
+        self.assertEqual(
+            {size: (variant['width'], variant['height']) for size, variant in image.variants.items()},
+            {'thumbnail': (320, 160), 'medium': (1024, 512)}
+        )
+        with image.image.storage.open(image.variants['thumbnail']['jpeg']) as thumbnail:
+            self.assertEqual(len(Image.open(thumbnail).getexif()), 0)
+
+        data = self.client.get('/api/products/').data['results'][0]['images'][0]
+        self.assertTrue(data['variants']['thumbnail']['webp'].endswith('.webp'))
+
+
+class ProductCreateTests(MediaTestCase):
+    def create_listing(self, images):
+        self.authenticate(self.seller)
+        return self.client.post('/api/products/', {
+            'title': 'Desk lamp',
+            'description': 'Barely used',
+            'price': '500',
+            'condition': 'good',
+            'location': 'Bangalore',
+            'images': images,
+        }, format='multipart')
+
+    def test_images_are_uploaded_in_one_batch(self):
+        uploads = [create_upload(size=(100, 100), color=color) for color in ('red', 'green', 'blue')]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.create_listing(uploads)
+        self.assertEqual(response.status_code, 201)
+
+        images = ProductImage.objects.filter(product_id=response.data['id'])
+        self.assertEqual(images.count(), 3)
+        self.assertEqual(images.filter(is_primary=True).count(), 1)
+        self.assertFalse(images.exclude(variant_status='ready').exists())
+
+    def test_failed_upload_creates_nothing(self):
+        uploads = [create_upload(size=(100, 100), color=color) for color in ('red', 'green', 'blue')]
+        original_save = FileSystemStorage._save
+        failing = hash_file(uploads[1])
+
+        def flaky_save(storage, name, content):
+            if failing in name:
+                raise OSError('Storage unavailable')
+            return original_save(storage, name, content)
+
+        with mock.patch.object(FileSystemStorage, '_save', flaky_save):
+            response = self.create_listing(uploads)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Product.objects.exists())
+        # Uploads that did succeed are removed again
+        stored = [files for _, _, files in os.walk(self.media_root)]
+        self.assertEqual(sum(map(len, stored)), 0)
+
+    def test_files_are_stored_outside_the_transaction(self):
+        uploads = [create_upload(size=(100, 100), color=color) for color in ('red', 'green')]
+        depth = len(connection.savepoint_ids)
+        depths = []
+
+        def recording_store(storage, files):
+            depths.append(len(connection.savepoint_ids))
+            return store_files(storage, files)
+
+        with mock.patch('products.uploads.store_files', recording_store):
+            response = self.create_listing(uploads)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(depths, [depth])
+        self.assertEqual(ImageBlob.objects.count(), 2)
+
+    def test_failed_insert_removes_staged_files(self):
+        uploads = [create_upload(size=(100, 100), color=color) for color in ('red', 'green')]
+        with mock.patch.object(ProductImage.objects, 'bulk_create', side_effect=DatabaseError):
+            response = self.create_listing(uploads)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Product.objects.exists())
+        self.assertFalse(ImageBlob.objects.exists())
+        stored = [files for _, _, files in os.walk(self.media_root)]
+        self.assertEqual(sum(map(len, stored)), 0)
+
+    def test_identical_images_are_stored_once(self):
+        for _ in range(2):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.create_listing([create_upload(size=(100, 100))])
+            self.assertEqual(response.status_code, 201)
+        # A single image through the model takes the same path
+        ProductImage.objects.create(
+            product_id=response.data['id'], image=create_upload(size=(100, 100))
+        )
+
+        blob = ImageBlob.objects.get()
+        self.assertEqual(blob.ref_count, 3)
+        self.assertEqual(set(ProductImage.objects.values_list('image', flat=True)), {blob.name})
+        self.assertTrue(blob.variants)
+
+        Product.objects.all().delete()
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 0)
+        self.assertEqual(ImageBlob.objects.collect_garbage(grace=timedelta(0)), 1)
+        self.assertFalse(ImageBlob.objects.exists())
+        stored = [files for _, _, files in os.walk(self.media_root)]
+        self.assertEqual(sum(map(len, stored)), 0)
+
+    def test_failed_image_insert_releases_its_reference(self):
+        product, = create_products(self.seller, self.category, 1, images=0)
+        image = ProductImage.objects.create(product=product, image=create_upload(size=(100, 100)))
+
+        with mock.patch.object(ProductImage, 'save_base', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                ProductImage.objects.create(product=product, image=create_upload(size=(100, 100)))
+        self.assertEqual(ImageBlob.objects.get(pk=image.blob_id).ref_count, 1)
+
+    def test_uploads_are_checked_while_streaming(self):
+        fake = SimpleUploadedFile('photo.jpg', b'<?php echo 1; ?>', content_type='image/jpeg')
+        response = self.create_listing([fake])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], 'Only JPEG and PNG images are allowed')
+
+        oversized = SimpleUploadedFile(
+            'photo.jpg', b'\xff\xd8\xff' + bytes(5 * 1024 * 1024), content_type='image/jpeg'
+        )
+        response = self.create_listing([oversized])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], 'Image size cannot exceed 5MB')
+        self.assertFalse(Product.objects.exists())
+
+
+@override_settings(PRODUCT_IMPORT_ASYNC=False)
+class ProductImportTests(MediaTestCase):
+    def upload(self, name, content):
+        self.authenticate(self.seller)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/products/import/', {
+                'file': SimpleUploadedFile(name, content.encode()),
+            }, format='multipart')
+        self.assertEqual(response.status_code, 202)
+        return self.client.get(f"/api/products/import/{response.data['id']}/").data
+
+    def test_csv_import(self):
+        job = self.upload('listings.csv', (
+            'title,description,price,condition,location,category,latitude,longitude\n'
+            f'Road bike,Lightly used,12000,good,Bangalore,{self.category.id},12.97,77.59\n'
+            'Broken row,No price,,good,Bangalore,,,\n'
+            f'Desk lamp,Warm light,500,new,Bangalore,{self.category.id},,\n'
+        ))
+        self.assertEqual(job['status'], 'completed')
+        self.assertEqual((job['processed_rows'], job['created_count'], job['error_count']), (3, 2, 1))
+        self.assertEqual(job['errors'][0]['row'], 2)
+        self.assertIn('price', job['errors'][0]['errors'])
+
+        bike = Product.objects.get(title='Road bike')
+        self.assertEqual((bike.seller, bike.category), (self.seller, self.category))
+        self.assertTrue(bike.geohash)
+        # Bulk inserted rows are searchable
+        response = self.client.get('/api/products/', {'search': 'lamp'})
+        self.assertEqual([p['title'] for p in response.data['results']], ['Desk lamp'])
+
+    def interrupted_job(self, claimed_at):
+        lines = [
+            json.dumps({'title': f'Book {index}', 'description': 'Paperback', 'price': '100',
+                        'condition': 'good', 'location': 'Bangalore'})
+            for index in range(5)
+        ]
+        return ImportJob.objects.create(
+            seller=self.seller,
+            file=SimpleUploadedFile('books.ndjson', '\n'.join(lines + ['[1, 2]']).encode()),
+            file_format='ndjson', status='running', processed_rows=2, created_count=2,
+            claimed_at=claimed_at,
+        )
+
+    def test_resumed_ndjson_import_skips_processed_rows(self):
+        job = self.interrupted_job(timezone.now() - IMPORT_CLAIM_TIMEOUT * 2)
+        job = run_import(job.pk, IMPORT_CLAIM_TIMEOUT)
+        self.assertEqual(job.status, 'completed')
+        self.assertEqual((job.processed_rows, job.created_count, job.error_count), (6, 5, 1))
+        self.assertEqual(
+            sorted(Product.objects.values_list('title', flat=True)), ['Book 2', 'Book 3', 'Book 4']
+        )
+        self.assertEqual(job.errors, [{'row': 6, 'errors': {'row': ['Must be a JSON object']}}])
+
+    def test_resume_skips_jobs_with_a_live_claim(self):
+        job = self.interrupted_job(timezone.now())
+        out = StringIO()
+        call_command('resume_imports', stdout=out)
+        self.assertIn(f'Job {job.pk}: skipped', out.getvalue())
+        self.assertIsNone(run_import(job.pk))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed_rows), ('running', 2))
+        self.assertFalse(Product.objects.exists())
+
+        # Once the worker has gone quiet for long enough the job is taken over
+        call_command('resume_imports', stale_after=0, stdout=out)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.created_count), ('completed', 5))
+
+    def test_worker_stops_once_its_claim_is_taken_over(self):
+        job = self.interrupted_job(None)
+        stale = claim_import(job.pk, IMPORT_CLAIM_TIMEOUT)
+        # Another worker takes over while this one is stalled
+        ImportJob.objects.filter(pk=job.pk).update(claimed_at=timezone.now() + timedelta(seconds=1))
+        with self.assertRaises(ImportJobLost):
+            import_chunk(stale, [(3, {'title': 'Book 9'})], set())
+        self.assertFalse(Product.objects.exists())
+        stale.refresh_from_db()
+        self.assertEqual((stale.status, stale.processed_rows), ('running', 2))
+
+
+class ProductExportTests(ProductTestCase):
+    def test_listing_exports_stream(self):
+        self.grow_products(3)
+        self.authenticate(self.seller)
+        response = self.client.get('/api/products/my/', {'output': 'ndjson'})
+        self.assertTrue(response.streaming)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([row['title'] for row in rows], ['Phone 2', 'Phone 1', 'Phone 0'])
+        self.assertEqual(rows[0]['category'], 'Phones')
+
+        response = self.client.get(f'/api/users/{self.seller.id}/products/', {'output': 'csv'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[0].startswith('id,title,description,price'))
+
+        response = self.client.get('/api/products/my/', {'output': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ProductExpiryTests(ProductTestCase):
+    def test_expired_listings_are_hidden_then_deactivated(self):
+        expired, upcoming, open_ended = create_products(self.seller, self.category, 3, images=0)
+        now = timezone.now()
+        Product.objects.filter(pk=expired.pk).update(expiry_date=now - timedelta(hours=1))
+        Product.objects.filter(pk=upcoming.pk).update(expiry_date=now + timedelta(days=1))
+
+        # Hidden as soon as expiry_date passes, before any sweep
+        response = self.client.get('/api/products/')
+        self.assertEqual(
+            {product['id'] for product in response.data['results']}, {upcoming.pk, open_ended.pk}
+        )
+        self.assertEqual(self.client.get(f'/api/products/{expired.pk}/').status_code, 404)
+
+        self.assertEqual(expire_listings(batch_size=1), 1)
+        self.assertEqual(
+            list(Product.objects.filter(is_active=False).values_list('pk', flat=True)), [expired.pk]
+        )
+        self.assertEqual(expire_listings(), 0)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Plans are captured with SQLite EXPLAIN QUERY PLAN')
+class ProductQueryPlanTests(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.products = create_products(self.seller, self.category, 3)
+        Product.objects.update(latitude=12.97, longitude=77.59)
+        Wishlist.objects.create(user=self.buyer, product=self.products[0])
+
+    def test_browse_queries_use_indexes(self):
+        for params in [
+            {},
+            {'category': self.category.id, 'min_price': 50, 'max_price': 500},
+            {'search': 'phone'},
+            {'near': '12.97,77.59', 'radius_km': 5},
+            {'condition': 'good', 'sort_by': 'price_asc'},
+        ]:
+            self.assertNoFullScans('/api/products/', params)
+        self.assertNoFullScans(f'/api/products/{self.products[0].id}/')
+        self.assertNoFullScans('/api/products/facets/')
+
+    def test_feeds_are_read_in_index_order(self):
+        for sort_by, index in [
+            ('newest', 'products_live_created_idx'),
+            ('popular', 'products_live_popular_idx'),
+        ]:
+            queries = self.assertNoFullScans('/api/products/', {'sort_by': sort_by})
+            sql = next(q['sql'] for q in queries if 'LIMIT' in q['sql'] and 'FROM "products"' in q['sql'])
+            plan = explain(sql)
+            self.assertIn(f'SCAN products USING INDEX {index}', plan)
+            self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plan)
+
+    def test_account_queries_use_indexes(self):
+        self.authenticate(self.buyer)
+        self.assertNoFullScans('/api/products/my/')
+        self.assertNoFullScans(f'/api/categories/{self.parent.id}/products/')
+        self.assertNoFullScans(f'/api/users/{self.seller.id}/products/')
+        self.assertNoFullScans('/api/wishlist/')
+
+    def test_expiry_sweep_uses_index(self):
+        sweep = Product.objects.filter(is_active=True, expiry_date__lte=timezone.now()).order_by('expiry_date')
+        self.assertIn('products_live_expiry_idx', sweep.explain())
@@ -0,0 +1,126 @@
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from django.db import transaction
+from django.utils import timezone
+from .blobs import blob_name, hash_file
+from .cache import bump_generation
+from .image_variants import variant_worker
+from .models import ImageBlob, Product, ProductImage
+
+logger = logging.getLogger(__name__)
+
+# Concurrent storage writes per request; bounded so one listing can't
+# exhaust the connection pool to the object store
+MAX_UPLOAD_WORKERS = 4
+
+
+def store_files(storage, files):
+    """Save {name: file} to storage concurrently; returns {name: stored name}"""
+    if not files:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(MAX_UPLOAD_WORKERS, len(files))) as pool:
+        futures = {name: pool.submit(storage.save, name, file) for name, file in files.items()}
+    stored, errors = {}, []
+    for name, future in futures.items():
+        try:
+            stored[name] = future.result()
+        except Exception as e:
+            errors.append(e)
+    if errors:
+        # Don't leave objects behind for a listing that won't be created
+        delete_files(storage, stored.values())
+        raise errors[0]
+    return stored
+
+
+def delete_files(storage, names):
+    for name in names:
+        try:
+            storage.delete(name)
+        except Exception as e:
+            logger.error(f"Error deleting uploaded file {name}: {str(e)}", exc_info=True)
+
+
+def stage_images(files):
+    """
+    Hash uploads and store the bytes that aren't stored yet under their
+    sha256, before the listing's transaction opens, so slow object-store
+    writes hold no database locks or connection. Pass the result to
+    add_product_images() inside the transaction, and to
+    discard_staged_images() if that transaction doesn't commit.
+    """
+    staged = {'files': files, 'digests': [], 'stored': {}}
+    if not files:
+        return staged
+    storage = ProductImage._meta.get_field('image').storage
+    with ThreadPoolExecutor(max_workers=min(MAX_UPLOAD_WORKERS, len(files))) as pool:
+        staged['digests'] = list(pool.map(hash_file, files))
+
+    # Unlocked: a blob collected before the transaction is stored again there
+    known = set(ImageBlob.objects.filter(sha256__in=staged['digests']).values_list('sha256', flat=True))
+    staged['stored'] = store_new_blobs(storage, staged, known)
+    return staged
+
+
+def store_new_blobs(storage, staged, known):
+    """Store each distinct upload whose digest isn't in `known`; returns {digest: stored name}"""
+    new_files = {}
+    for digest, file in zip(staged['digests'], staged['files']):
+        if digest not in known and digest not in staged['stored']:
+            new_files.setdefault(blob_name(digest, file), (digest, file))
+    stored = store_files(storage, {name: file for name, (_, file) in new_files.items()})
+    return {digest: stored[name] for name, (digest, _) in new_files.items()}
+
+
+def discard_staged_images(staged):
+    """Delete the files a rolled back add_product_images() would have referenced"""
+    storage = ProductImage._meta.get_field('image').storage
+    delete_files(storage, staged['stored'].values())
+
+
+def add_product_images(product, staged):
+    """
+    Insert the rows for images staged by stage_images() with one bulk_create.
+
+    Meant to run inside the transaction that creates the product. Only
+    database work happens here: the blob rows are locked or inserted and
+    referenced, so garbage collection can't delete them in between.
+    bulk_create skips the ProductImage signals, so their work (ETag touch,
+    cache invalidation, variant generation) is done here.
+    """
+    digests = staged['digests']
+    if not digests:
+        return []
+    storage = ProductImage._meta.get_field('image').storage
+
+    existing = ImageBlob.objects.select_for_update().filter(sha256__in=digests)
+    blobs = {blob.sha256: blob for blob in existing}
+    if any(digest not in blobs and digest not in staged['stored'] for digest in digests):
+        # Collected since staging; rare enough to store inside the transaction
+        staged['stored'].update(store_new_blobs(storage, staged, set(blobs)))
+
+    new_blobs = {digest: name for digest, name in staged['stored'].items() if digest not in blobs}
+    if new_blobs:
+        ImageBlob.objects.bulk_create([
+            ImageBlob(sha256=digest, name=name, size=staged['files'][digests.index(digest)].size)
+            for digest, name in new_blobs.items()
+        ], ignore_conflicts=True)
+        blobs.update((blob.sha256, blob) for blob in existing.all())
+        # Identical bytes uploaded concurrently by another request keep its copy
+        duplicates = [digest for digest, name in new_blobs.items() if blobs[digest].name != name]
+        delete_files(storage, [staged['stored'].pop(digest) for digest in duplicates])
+
+    ImageBlob.objects.add_references(Counter(blobs[digest].pk for digest in digests))
+    images = ProductImage.objects.bulk_create([
+        ProductImage(
+            product=product, image=blobs[digest].name, blob=blobs[digest], is_primary=index == 0
+        )
+        for index, digest in enumerate(digests)
+    ])
+    Product.objects.filter(pk=product.pk).update(updated_at=timezone.now())
+
+    transaction.on_commit(bump_generation)
+    for image in images:
+        transaction.on_commit(lambda image_id=image.pk: variant_worker.enqueue(image_id))
+    return images
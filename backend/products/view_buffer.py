@@ -0,0 +1,160 @@
+import logging
+import threading
+from collections import Counter, defaultdict
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from .hyperloglog import HyperLogLog
+from .models import Product, ProductAnalytics, ProductView
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FLUSH_INTERVAL = 10  # seconds
+MAX_PENDING_VIEWS = 1000
+# View rows kept for retry while the database is failing; counters are kept
+# regardless, only the oldest raw ProductView rows are dropped beyond this
+MAX_RETAINED_VIEWS = 10 * MAX_PENDING_VIEWS
+
+
+class ViewBuffer:
+    """
+    Write-behind buffer for product detail views.
+
+    Views are collected in memory and flushed periodically by a background
+    thread: ProductView rows in one bulk insert, views_count as one
+    F() UPDATE per distinct increment, and ProductAnalytics totals plus a
+    merged HyperLogLog of viewers for unique_views. A failed flush puts
+    its views back for the next one. Like any write-behind counter, up to
+    one interval of views is lost if the process dies.
+    """
+
+    def __init__(self, max_pending=MAX_PENDING_VIEWS):
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._reset()
+
+    def _reset(self):
+        self._counts = Counter()
+        self._views = []
+        self._sketches = defaultdict(HyperLogLog)
+
+    def clear(self):
+        """Discard buffered views without writing them"""
+        with self._lock:
+            self._reset()
+
+    @property
+    def flush_interval(self):
+        return getattr(settings, 'PRODUCT_VIEW_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL)
+
+    def record(self, product_id, viewer_id=None, ip_address=None):
+        with self._lock:
+            self._counts[product_id] += 1
+            self._views.append(
+                ProductView(product_id=product_id, viewer_id=viewer_id, ip_address=ip_address)
+            )
+            viewer = f'user:{viewer_id}' if viewer_id else f'ip:{ip_address}'
+            self._sketches[product_id].add(viewer)
+            pending = len(self._views)
+
+        if self.flush_interval is None:
+            # No background thread: flush inline once the buffer is full
+            if pending >= self.max_pending:
+                self.flush()
+            return
+
+        self._ensure_thread()
+        if pending >= self.max_pending:
+            self._wakeup.set()
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='product-view-flusher', daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval or DEFAULT_FLUSH_INTERVAL)
+            self._wakeup.clear()
+            # Like a request, drop connections that are broken or past CONN_MAX_AGE
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing product views: {str(e)}", exc_info=True)
+            finally:
+                close_old_connections()
+
+    def _requeue(self, counts, views, sketches):
+        """Merge a batch that failed to write back into the buffer"""
+        with self._lock:
+            self._counts.update(counts)
+            self._views[:0] = views
+            del self._views[:-MAX_RETAINED_VIEWS]
+            for product_id, sketch in sketches.items():
+                self._sketches[product_id].merge(sketch)
+
+    def flush(self):
+        with self._lock:
+            counts, views, sketches = self._counts, self._views, self._sketches
+            self._reset()
+        if not views:
+            return 0
+        try:
+            return self._write(counts, views, sketches)
+        except Exception:
+            self._requeue(counts, views, sketches)
+            raise
+
+    def _write(self, counts, views, sketches):
+        # Drop views of products deleted since they were recorded
+        existing = set(Product.objects.filter(pk__in=counts).values_list('pk', flat=True))
+        views = [view for view in views if view.product_id in existing]
+        counts = {product_id: count for product_id, count in counts.items() if product_id in existing}
+        if not views:
+            return 0
+
+        with transaction.atomic():
+            ProductView.objects.bulk_create(views, batch_size=500)
+
+            # Products viewed the same number of times share one UPDATE
+            by_increment = defaultdict(list)
+            for product_id, count in counts.items():
+                by_increment[count].append(product_id)
+            for count, product_ids in by_increment.items():
+                Product.objects.filter(pk__in=product_ids).update(
+                    views_count=F('views_count') + count
+                )
+
+            product_ids = list(counts)
+            ProductAnalytics.objects.bulk_create(
+                [ProductAnalytics(product_id=product_id) for product_id in product_ids],
+                ignore_conflicts=True
+            )
+            rows = list(
+                ProductAnalytics.objects.select_for_update().filter(product_id__in=product_ids)
+            )
+            now = timezone.now()
+            for analytics in rows:
+                sketch = HyperLogLog(bytes(analytics.viewer_sketch))
+                sketch.merge(sketches[analytics.product_id])
+                analytics.viewer_sketch = sketch.to_bytes()
+                analytics.unique_views = sketch.count()
+                analytics.total_views = F('total_views') + counts[analytics.product_id]
+                analytics.last_updated = now
+            ProductAnalytics.objects.bulk_update(
+                rows, ['total_views', 'unique_views', 'viewer_sketch', 'last_updated']
+            )
+        return len(views)
+
+
+view_buffer = ViewBuffer()
+
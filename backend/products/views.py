@@ -1,82 +1,252 @@
-from django.shortcuts import render
+from django.shortcuts import get_object_or_404, render
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
+from django.db import transaction
 from django.db.models import Q, Sum, Count
 from django.utils import timezone
 from datetime import timedelta
-from .models import Product, ProductImage, Category, Wishlist, ProductView, ProductAnalytics
+from decimal import Decimal, InvalidOperation
+from .models import Product, ProductImage, Category, Wishlist, ProductView, ProductAnalytics, ImportJob
 from chat.models import ChatRoom
-from .serializers import ProductSerializer, ProductImageSerializer, CategorySerializer, WishlistSerializer
-from rest_framework.parsers import MultiPartParser, FormParser
+from .serializers import (
+    ProductSerializer, ProductListSerializer, ProductImageSerializer,
+    CategorySerializer, WishlistSerializer, ImportJobSerializer, PRODUCT_EXPORT_COLUMNS
+)
+from .search import search_products
+from .geo import filter_nearby
+from .facets import get_facets
+from .view_buffer import view_buffer
+from .uploads import add_product_images, discard_staged_images, stage_images
+from .imports import detect_format, start_import
+from .rollups import MAX_PERIODS, get_time_series
+from .category_tree import get_category_tree, get_category_tree_version
+from .cache import (
+    RESPONSE_CACHE_TIMEOUT, get_generation, response_cache_key, get_cached_response, set_cached_response, get_cache_stats
+)
+from rest_framework.parsers import FormParser, MultiPartParser
+from localmart.pagination import KeysetPagination
+from localmart.conditional import ConditionalGetMixin
+from localmart.uploads import ImageMultiPartParser
+from localmart.exports import get_export_format, stream_export
+from functools import partial
+import ipaddress
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_RADIUS_KM = 25
+MAX_RADIUS_KM = 500
+# ?sort_by= modes; anything else is rejected rather than passed to order_by()
+SORT_MODES = {
+    'newest': ['-created_at'],
+    'price_asc': ['price'],
+    'price_desc': ['-price'],
+    'distance': ['distance'],
+    'popular': ['-popularity_score'],
+    'relevance': ['-search_rank'],
+}
+# Modes that sort on an annotation, and the parameter that adds it
+SORT_ANNOTATIONS = {
+    'distance': 'near',
+    'relevance': 'search',
+}
+
+def filter_near(queryset, query_params):
+    """Apply ?near=lat,lng&radius_km= and annotate each product's `distance`"""
+    near = query_params.get('near')
+    if not near:
+        if query_params.get('sort_by') == 'distance':
+            raise ValidationError({'near': 'Required when sorting by distance'})
+        return queryset
+
+    try:
+        latitude, longitude = (float(value) for value in near.split(','))
+        radius_km = float(query_params.get('radius_km', DEFAULT_RADIUS_KM))
+    except ValueError:
+        raise ValidationError({'near': 'Expected near=<latitude>,<longitude> and a numeric radius_km'})
+
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValidationError({'near': 'Coordinates out of range'})
+    if not 0 < radius_km <= MAX_RADIUS_KM:
+        raise ValidationError({'radius_km': f'Must be between 0 and {MAX_RADIUS_KM}'})
+
+    return filter_nearby(queryset, latitude, longitude, radius_km)
+
+def apply_sort(queryset, query_params):
+    """
+    Order by the ?sort_by= mode. Defaults to relevance for searches,
+    distance for ?near= and newest otherwise.
+    """
+    annotations = queryset.query.annotations
+    if 'search_rank' in annotations:
+        default = 'relevance'
+    elif 'distance' in annotations:
+        default = 'distance'
+    else:
+        default = 'newest'
+    mode = query_params.get('sort_by', default)
+    if mode not in SORT_MODES:
+        raise ValidationError({'sort_by': f"Must be one of: {', '.join(SORT_MODES)}"})
+    if mode in SORT_ANNOTATIONS and SORT_MODES[mode][0].lstrip('-') not in annotations:
+        raise ValidationError({SORT_ANNOTATIONS[mode]: f'Required when sorting by {mode}'})
+    return queryset.order_by(*SORT_MODES[mode])
+
+def price_filters(query_params):
+    """The price range lookups for min_price/max_price, rejecting non-numbers"""
+    filters = {}
+    for param in ['min_price', 'max_price']:
+        value = query_params.get(param)
+        if value:
+            try:
+                price = Decimal(value)
+            except InvalidOperation:
+                raise ValidationError({param: 'Must be a number'})
+            if not price.is_finite():
+                raise ValidationError({param: 'Must be a number'})
+            filters[f"price__{'gte' if param == 'min_price' else 'lte'}"] = price
+    return filters
+
+
+def filter_attributes(queryset, query_params):
+    """Apply the category, condition, location, price and urgency filters"""
+    filters = {}
+    
+    for param in ['category', 'condition', 'location']:
+        value = query_params.get(param)
+        if value:
+            filters[f"{param}__iexact" if param == 'location' else param] = value
+
+    if 'category' in filters and not filters['category'].isdigit():
+        raise ValidationError({'category': 'Must be a category id'})
+    
+    filters.update(price_filters(query_params))
+    
+    if filters:
+        queryset = queryset.filter(**filters)
+    
+    is_urgent = query_params.get('is_urgent')
+    if is_urgent:
+        queryset = queryset.filter(is_urgent=is_urgent.lower() == 'true')
+    return queryset
+
 # Create your views here.
 
-class ProductViewSet(viewsets.ModelViewSet):
+def get_client_ip(request):
+    """The client's address, or None when the header doesn't hold a valid IP"""
+    forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+    if forwarded_for:
+        address = forwarded_for.split(',')[0].strip()
+    else:
+        address = request.META.get('REMOTE_ADDR')
+    try:
+        return str(ipaddress.ip_address(address))
+    except ValueError:
+        return None
+
+
+class ProductViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     serializer_class = ProductSerializer
-    parser_classes = (MultiPartParser, FormParser)
+    parser_classes = (ImageMultiPartParser, FormParser)
+    pagination_class = KeysetPagination
     
     def get_permissions(self):
         """
         List and retrieve can be accessed without authentication
         Other actions require authentication
         """
-        if self.action in ['list', 'retrieve']:
+        if self.action in ['list', 'retrieve', 'facets']:
             permission_classes = [AllowAny]
+        elif self.action == 'cache_stats':
+            permission_classes = [IsAdminUser]
         else:
             permission_classes = [IsAuthenticated]
         return [permission() for permission in permission_classes]
+
+    def list(self, request, *args, **kwargs):
+        handler = partial(self.cached_response, super().list)
+        return self.conditional_response(handler, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        handler = partial(self.cached_response, super().retrieve)
+        response = self.conditional_response(handler, request, *args, **kwargs)
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            viewer_id = request.user.id if request.user.is_authenticated else None
+            view_buffer.record(int(kwargs['pk']), viewer_id, get_client_ip(request))
+        return response
+
+    def get_validators(self, request, pk=None, **kwargs):
+        params = sorted(request.query_params.lists())
+        category_version = get_category_tree_version()
+        if self.action == 'retrieve':
+            try:
+                updated_at = Product.objects.live().filter(
+                    pk=pk
+                ).values_list('updated_at', flat=True).first()
+            except ValueError:
+                return None
+            if updated_at is None:
+                return None
+            return [pk, updated_at, params, category_version], updated_at
+
+        # Every listing write, rescore and expiry sweep bumps the generation.
+        # The time bucket retires ETags as often as cached responses, so
+        # listings passing expiry_date between sweeps drop out as well.
+        bucket = int(time.time() // RESPONSE_CACHE_TIMEOUT)
+        return [get_generation(), bucket, params, category_version], None
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        """Serve anonymous GETs from the response cache"""
+        if request.user.is_authenticated:
+            return handler(request, *args, **kwargs)
+
+        key = response_cache_key(request, self.action, kwargs.get('pk'))
+        data = get_cached_response(key)
+        if data is not None:
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            set_cached_response(key, response.data)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def get_serializer_class(self):
+        if self.action in ['list', 'my_listings']:
+            return ProductListSerializer
+        return ProductSerializer
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.request.method == 'GET':
+            # Only select the columns the (possibly ?fields= narrowed) serializer renders
+            queryset = self.get_serializer().prepare_queryset(queryset)
+        return queryset
     
     def get_queryset(self):
         """Get products with filters"""
-        queryset = Product.objects.filter(is_active=True)
+        queryset = Product.objects.with_related().live()
         
         # Get all products for list/retrieve actions
-        if self.action in ['list', 'retrieve']:
-            # Apply basic filters
-            category = self.request.query_params.get('category', None)
-            if category:
-                queryset = queryset.filter(category_id=category)
+        if self.action in ['list', 'retrieve', 'facets']:
+            queryset = filter_attributes(queryset, self.request.query_params)
             
             search = self.request.query_params.get('search', None)
             if search:
-                queryset = queryset.filter(
-                    Q(title__icontains=search) |
-                    Q(description__icontains=search)
-                )
-            
-            sort_by = self.request.query_params.get('sort_by', '-created_at')
-            queryset = queryset.order_by(sort_by)
-            
-            return queryset[:50]  # Limit results for unauthenticated users
+                queryset = search_products(queryset, search)
+
+            queryset = filter_near(queryset, self.request.query_params)
+            return apply_sort(queryset, self.request.query_params)
         
         # For authenticated users, apply all filters
         if self.request.user.is_authenticated:
-            filters = {}
-            
-            for param in ['category', 'condition', 'location']:
-                value = self.request.query_params.get(param)
-                if value:
-                    filters[f"{param}__iexact" if param == 'location' else param] = value
-            
-            for param in ['min_price', 'max_price']:
-                value = self.request.query_params.get(param)
-                if value:
-                    filters[f"price__{'gte' if param == 'min_price' else 'lte'}"] = value
-            
-            if filters:
-                queryset = queryset.filter(**filters)
-            
-            is_urgent = self.request.query_params.get('is_urgent')
-            if is_urgent:
-                queryset = queryset.filter(is_urgent=is_urgent.lower() == 'true')
-            
-            sort_by = self.request.query_params.get('sort_by', '-created_at')
-            return queryset.order_by(sort_by)
+            queryset = filter_attributes(queryset, self.request.query_params)
+            return apply_sort(queryset, self.request.query_params)
         
         return queryset.none()
 
@@ -96,6 +266,8 @@ class ProductViewSet(viewsets.ModelViewSet):
                 'condition': request.data.get('condition'),
                 'quantity': request.data.get('quantity', 1),
                 'location': request.data.get('location'),
+                'latitude': request.data.get('latitude') or None,
+                'longitude': request.data.get('longitude') or None,
                 'is_urgent': request.data.get('is_urgent', '').lower() == 'true',
                 'seller': request.user.id
             }
@@ -107,17 +279,16 @@ class ProductViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            product = serializer.save()
-
-            # Handle images
-            images = request.FILES.getlist('images')
-            if images:
-                for index, image in enumerate(images):
-                    ProductImage.objects.create(
-                        product=product,
-                        image=image,
-                        is_primary=(index == 0)
-                    )
+            # Images upload concurrently before the transaction opens; a failed
+            # upload or insert leaves no listing or stored files behind
+            staged = stage_images(request.FILES.getlist('images'))
+            try:
+                with transaction.atomic():
+                    product = serializer.save()
+                    add_product_images(product, staged)
+            except Exception:
+                discard_staged_images(staged)
+                raise
 
             return Response(
                 ProductSerializer(product).data,
@@ -139,63 +310,134 @@ class ProductViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_401_UNAUTHORIZED
             )
             
-        queryset = self.get_queryset().filter(seller=request.user)
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        output = get_export_format(request)
+        if output:
+            queryset = self.get_queryset().filter(seller=request.user)
+            return stream_export(queryset, PRODUCT_EXPORT_COLUMNS, output, 'my-listings')
+
+        queryset = self.filter_queryset(self.get_queryset().filter(seller=request.user))
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['POST'], url_path='import', parser_classes=[MultiPartParser])
+    def bulk_import(self, request):
+        """Queue a CSV or NDJSON file of listings for import"""
+        file = request.FILES.get('file')
+        if file is None:
+            raise ValidationError({'file': 'A CSV or NDJSON file is required'})
+        file_format = request.data.get('file_format') or detect_format(file.name)
+        if file_format not in dict(ImportJob.FORMAT_CHOICES):
+            raise ValidationError({'file_format': 'Must be csv or ndjson'})
+
+        with transaction.atomic():
+            job = ImportJob.objects.create(seller=request.user, file=file, file_format=file_format)
+            start_import(job)
+        return Response(ImportJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['GET'], url_path=r'import/(?P<job_id>\d+)')
+    def import_status(self, request, job_id=None):
+        job = get_object_or_404(ImportJob, pk=job_id, seller=request.user)
+        return Response(ImportJobSerializer(job).data)
+
+    @action(detail=False, methods=['GET'])
+    def facets(self, request):
+        """Result counts per filter value for the current filter set"""
+        return Response(get_facets(self.get_queryset(), request.query_params))
+
+    @action(detail=False, methods=['GET'])
+    def cache_stats(self, request):
+        """Hit/miss counters of the anonymous response cache"""
+        return Response(get_cache_stats())
 
     @action(detail=True, methods=['GET'])
     def analytics(self, request, pk=None):
-        product = self.get_object()
-        if product.seller != request.user:
+        product = get_object_or_404(
+            self.get_queryset().select_related(None).prefetch_related(None), pk=pk
+        )
+        if product.seller_id != request.user.id:
             return Response(
                 {'error': 'Not authorized to view analytics'},
                 status=status.HTTP_403_FORBIDDEN
             )
             
+        granularity = request.query_params.get('granularity', 'day')
+        if granularity not in MAX_PERIODS:
+            raise ValidationError({'granularity': f"Must be one of: {', '.join(MAX_PERIODS)}"})
+        try:
+            periods = int(request.query_params.get('periods', 30))
+        except ValueError:
+            raise ValidationError({'periods': 'Must be a number'})
+        if not 1 <= periods <= MAX_PERIODS[granularity]:
+            raise ValidationError(
+                {'periods': f'Must be between 1 and {MAX_PERIODS[granularity]}'}
+            )
+
         analytics = ProductAnalytics.objects.get_or_create(product=product)[0]
         return Response({
             'views': analytics.total_views,
             'unique_views': analytics.unique_views,
             'wishlist_adds': analytics.wishlist_adds,
-            'message_count': analytics.message_count
+            'message_count': analytics.message_count,
+            **get_time_series(product, granularity, periods)
         })
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Category.objects.filter(is_active=True)
     serializer_class = CategorySerializer
     permission_classes = [AllowAny]
 
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(self.list_tree, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(self.retrieve_node, request, *args, **kwargs)
+
+    def list_tree(self, request, *args, **kwargs):
+        nodes, _ = get_category_tree()
+        return Response(nodes)
+
+    def retrieve_node(self, request, *args, **kwargs):
+        _, by_id = get_category_tree()
+        try:
+            return Response(by_id[int(kwargs['pk'])])
+        except (KeyError, ValueError):
+            raise NotFound()
+
+    def get_validators(self, request, pk=None, **kwargs):
+        return [pk, get_category_tree_version()], None
+
     @action(detail=True, methods=['get'])
     def products(self, request, pk=None):
         category = self.get_object()
-        products = Product.objects.filter(
-            Q(category=category) | Q(category__parent=category),
-            is_active=True
+        products = Product.objects.with_related().live().filter(
+            category.descendants_filter()
         )
         
         # Apply filters
-        if 'min_price' in request.query_params:
-            products = products.filter(price__gte=request.query_params['min_price'])
-        if 'max_price' in request.query_params:
-            products = products.filter(price__lte=request.query_params['max_price'])
+        products = products.filter(**price_filters(request.query_params))
         if 'location' in request.query_params:
             products = products.filter(location__icontains=request.query_params['location'])
+        products = filter_near(products, request.query_params)
         if 'search' in request.query_params:
-            search_query = request.query_params['search']
-            products = products.filter(
-                Q(title__icontains=search_query) |
-                Q(description__icontains=search_query)
-            )
-            
-        serializer = ProductSerializer(products, many=True)
-        return Response(serializer.data)
+            products = search_products(products, request.query_params['search'])
+        products = apply_sort(products, request.query_params)
+
+        context = self.get_serializer_context()
+        products = ProductListSerializer(context=context).prepare_queryset(products)
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(products, request, view=self)
+        serializer = ProductListSerializer(page, many=True, context=context)
+        return paginator.get_paginated_response(serializer.data)
 
 class WishlistViewSet(viewsets.ModelViewSet):
     serializer_class = WishlistSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return Wishlist.objects.filter(user=self.request.user)
+        return Wishlist.objects.filter(user=self.request.user).select_related(
+            'product__seller', 'product__category'
+        ).prefetch_related('product__images')
 
     def list(self, request):
         queryset = self.get_queryset()
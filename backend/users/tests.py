@@ -1,3 +1,22 @@
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from .models import User
 
-# Create your tests here.
+
+class ProfilePictureUploadTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='user@example.com', password='pass1234')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def test_non_image_is_rejected(self):
+        upload = SimpleUploadedFile('avatar.png', b'GIF89a', content_type='image/png')
+        response = self.client.patch(
+            '/api/users/profile/', {'profile_picture': upload}, format='multipart'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['detail'], 'Only JPEG and PNG images are allowed')
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.profile_picture)
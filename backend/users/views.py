@@ -2,12 +2,16 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.parsers import FormParser, JSONParser
 from django.contrib.auth import authenticate
 from rest_framework_simplejwt.tokens import RefreshToken
 from .serializers import UserSerializer, UserDetailSerializer
-from products.serializers import ProductSerializer
+from products.serializers import ProductListSerializer, PRODUCT_EXPORT_COLUMNS
 from .models import User
 from products.models import Product
+from localmart.pagination import KeysetPagination
+from localmart.uploads import ImageMultiPartParser
+from localmart.exports import get_export_format, stream_export
 import logging
 
 logger = logging.getLogger(__name__)
@@ -97,11 +101,20 @@ class UserViewSet(viewsets.ModelViewSet):
     def products(self, request, pk=None):
         """Get seller's products"""
         user = self.get_object()
-        products = Product.objects.filter(seller=user, is_active=True)
-        serializer = ProductSerializer(products, many=True)
-        return Response(serializer.data)
-
-    @action(detail=False, methods=['PATCH'])
+        output = get_export_format(request)
+        if output:
+            products = Product.objects.live().filter(seller=user)
+            return stream_export(products, PRODUCT_EXPORT_COLUMNS, output, f'seller-{user.id}-listings')
+
+        products = Product.objects.with_related().live().filter(seller=user)
+        context = self.get_serializer_context()
+        products = ProductListSerializer(context=context).prepare_queryset(products)
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(products, request, view=self)
+        serializer = ProductListSerializer(page, many=True, context=context)
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['PATCH'], parser_classes=[JSONParser, FormParser, ImageMultiPartParser])
     def profile(self, request):
         """Update user profile"""
         user = request.user
@@ -31,7 +31,7 @@ export default function ProductCard({
             <Image
                 source={
                     product.images && product.images.length > 0
-                        ? { uri: product.images[0].image }
+                        ? { uri: product.images[0].variants?.thumbnail?.webp || product.images[0].image }
                         : require('../../assets/placeholder.png')
                 }
                 style={styles.image}
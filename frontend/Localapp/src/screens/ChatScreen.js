@@ -15,24 +15,61 @@ import { format } from 'date-fns';
 import { useAuth } from '../context/AuthContext';
 import { getChatMessages, sendMessage } from '../services/chat';
 
+const getCursor = (url) => {
+    const match = url && url.match(/[?&]cursor=([^&]+)/);
+    return match ? decodeURIComponent(match[1]) : null;
+};
+
+// A message is read once its recipient's watermark has reached it
+const withReadStatus = (messages, readUpTo) => {
+    if (!readUpTo) return messages;
+    return messages.map(message => {
+        const recipient = Object.keys(readUpTo).find(userId => Number(userId) !== message.sender.id);
+        const watermark = recipient ? readUpTo[recipient] : null;
+        const isRead = watermark != null && message.id <= watermark;
+        return isRead === message.is_read ? message : { ...message, is_read: isRead };
+    });
+};
+
 export default function ChatScreen({ route, navigation }) {
     const { chatRoomId, productId, sellerId } = route.params;
     const [messages, setMessages] = useState([]);
     const [newMessage, setNewMessage] = useState('');
     const [loading, setLoading] = useState(true);
+    const [loadingOlder, setLoadingOlder] = useState(false);
     const { currentUser } = useAuth();
     const flatListRef = useRef();
+    const lastMessageIdRef = useRef(null);
+    const olderCursorRef = useRef(null);
 
     useEffect(() => {
+        lastMessageIdRef.current = null;
+        olderCursorRef.current = null;
         loadMessages();
         const interval = setInterval(loadMessages, 5000); // Poll every 5 seconds
         return () => clearInterval(interval);
     }, [chatRoomId]);
 
+    // Messages are kept newest first for the inverted list
     const loadMessages = async () => {
         try {
-            const data = await getChatMessages(chatRoomId);
-            setMessages(data);
+            // After the first page, polls only fetch what's new
+            const after = lastMessageIdRef.current;
+            const data = await getChatMessages(chatRoomId, { after });
+            const loaded = after ? [...data.results].reverse() : data.results;
+            if (loaded.length) {
+                lastMessageIdRef.current = loaded[0].id;
+            }
+            if (after) {
+                setMessages(prev => {
+                    const known = new Set(prev.map(message => message.id));
+                    const added = loaded.filter(message => !known.has(message.id));
+                    return withReadStatus([...added, ...prev], data.read_up_to);
+                });
+            } else {
+                olderCursorRef.current = getCursor(data.next);
+                setMessages(loaded);
+            }
         } catch (error) {
             console.error('Error loading messages:', error);
         } finally {
@@ -40,14 +77,34 @@ export default function ChatScreen({ route, navigation }) {
         }
     };
 
+    const loadOlderMessages = async () => {
+        const cursor = olderCursorRef.current;
+        if (!cursor || loadingOlder) return;
+
+        setLoadingOlder(true);
+        try {
+            const data = await getChatMessages(chatRoomId, { cursor });
+            olderCursorRef.current = getCursor(data.next);
+            setMessages(prev => {
+                const known = new Set(prev.map(message => message.id));
+                const older = data.results.filter(message => !known.has(message.id));
+                return withReadStatus([...prev, ...older], data.read_up_to);
+            });
+        } catch (error) {
+            console.error('Error loading older messages:', error);
+        } finally {
+            setLoadingOlder(false);
+        }
+    };
+
     const handleSend = async () => {
         if (!newMessage.trim()) return;
 
         try {
             const message = await sendMessage(chatRoomId, newMessage.trim());
-            setMessages(prev => [...prev, message]);
+            setMessages(prev => [message, ...prev]);
             setNewMessage('');
-            flatListRef.current?.scrollToEnd();
+            flatListRef.current?.scrollToOffset({ offset: 0 });
         } catch (error) {
             console.error('Error sending message:', error);
         }
@@ -62,9 +119,19 @@ export default function ChatScreen({ route, navigation }) {
                 isOwnMessage ? styles.ownMessage : styles.otherMessage
             ]}>
                 <Text style={styles.messageText}>{item.content}</Text>
-                <Text style={styles.timestamp}>
-                    {format(new Date(item.created_at), 'HH:mm')}
-                </Text>
+                <View style={styles.meta}>
+                    <Text style={styles.timestamp}>
+                        {format(new Date(item.created_at), 'HH:mm')}
+                    </Text>
+                    {isOwnMessage && (
+                        <Ionicons
+                            name={item.is_read ? 'checkmark-done' : 'checkmark'}
+                            size={14}
+                            color="rgba(255,255,255,0.7)"
+                            style={styles.readStatus}
+                        />
+                    )}
+                </View>
             </View>
         );
     };
@@ -89,7 +156,12 @@ export default function ChatScreen({ route, navigation }) {
                 renderItem={renderMessage}
                 keyExtractor={item => item.id.toString()}
                 contentContainerStyle={styles.messagesList}
-                onContentSizeChange={() => flatListRef.current?.scrollToEnd()}
+                inverted={messages.length > 0}
+                onEndReached={loadOlderMessages}
+                onEndReachedThreshold={0.3}
+                ListFooterComponent={
+                    loadingOlder ? <ActivityIndicator style={styles.olderLoader} color="#007AFF" /> : null
+                }
                 ListEmptyComponent={
                     <View style={styles.emptyContainer}>
                         <Text style={styles.emptyText}>No messages yet</Text>
@@ -146,11 +218,21 @@ const styles = StyleSheet.create({
         fontSize: 16,
         color: '#fff',
     },
+    meta: {
+        flexDirection: 'row',
+        alignItems: 'center',
+        alignSelf: 'flex-end',
+        marginTop: 5,
+    },
     timestamp: {
         fontSize: 12,
         color: '#rgba(255,255,255,0.7)',
-        marginTop: 5,
-        alignSelf: 'flex-end',
+    },
+    readStatus: {
+        marginLeft: 4,
+    },
+    olderLoader: {
+        paddingVertical: 10,
     },
     inputContainer: {
         flexDirection: 'row',
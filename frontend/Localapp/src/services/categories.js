@@ -42,7 +42,8 @@ export const getCategoryProducts = async (categoryId, filters = {}) => {
             throw new Error('Failed to fetch category products');
         }
 
-        return await response.json();
+        const data = await response.json();
+        return Array.isArray(data) ? data : data.results || [];
     } catch (error) {
         console.error('Error fetching category products:', error);
         throw error;
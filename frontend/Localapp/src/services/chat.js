@@ -11,9 +11,16 @@ export const getChats = async () => {
     }
 };
 
-export const getChatMessages = async (chatId) => {
+// Newest page first; pass { cursor } from a page's `next` link for older messages,
+// or { after: messageId } to fetch only newer messages, oldest first
+export const getChatMessages = async (chatId, params = {}) => {
     try {
-        return await apiClient.get(`/chat/rooms/${chatId}/messages/`);
+        const queryParams = new URLSearchParams(
+            Object.entries(params).filter(([_, value]) => value)
+        ).toString();
+        return await apiClient.get(
+            `/chat/rooms/${chatId}/messages/${queryParams ? `?${queryParams}` : ''}`
+        );
     } catch (error) {
         if (error.message === 'Authentication required') {
             throw new Error('Please login to view messages');
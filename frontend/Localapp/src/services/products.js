@@ -68,7 +68,8 @@ export const getProducts = async (filters = {}) => {
 
 export const getMyListings = async () => {
     try {
-        const products = await apiClient.get('/products/my/');
+        const response = await apiClient.get('/products/my/');
+        const products = Array.isArray(response) ? response : response.results || [];
         return products.map(product => ({
             ...product,
             images: product.images.map(img => ({
@@ -36,7 +36,8 @@ export const getSellerProducts = async (sellerId) => {
             throw new Error('Failed to fetch seller products');
         }
 
-        return await response.json();
+        const data = await response.json();
+        return Array.isArray(data) ? data : data.results || [];
     } catch (error) {
         console.error('Error fetching seller products:', error);
         throw error;